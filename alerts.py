@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import re
+from collections import namedtuple
+from datetime import date, timedelta
+
+from checklists import get_checklist_registry, normalize_zone
+from photo_store import DEFAULT_DATA_DIR
+from scoring import CRITICAL_WEIGHT, question_weight
+
+# Optional JSON file with a list of rules that replaces DEFAULT_RULES
+ALERT_RULES_FILE = os.environ.get("ACL_ALERT_RULES")
+
+# Every new alert is also appended here, for anything that tails the log
+ALERT_LOG = os.path.join(DEFAULT_DATA_DIR, "alerts.jsonl")
+
+SEVERITIES = ("critical", "high", "warning")
+
+# Each rule matches answers by zone, question wording (a regular expression),
+# question id, critical weight and answer. With repeat, it only fires once the
+# same zone and question has matched that many times within window_days.
+# Rules are tried in order and the first one that fires wins, so an answer
+# raises at most one alert.
+DEFAULT_RULES = (
+    {
+        'name': "Cold chain failure",
+        'severity': "critical",
+        'question': r"degrees celsius|(correct|required) temperature|temperature within",
+        'answer': "No",
+    },
+    {
+        'name': "Pest activity",
+        'severity': "critical",
+        'question': r"\bpest",
+        'answer': "No",
+    },
+    {
+        'name': "Critical check failed",
+        'severity': "high",
+        'critical': True,
+        'answer': "No",
+    },
+    {
+        'name': "Repeated failure",
+        'severity': "warning",
+        'answer': "No",
+        'repeat': 3,
+        'window_days': 30,
+    },
+)
+
+RULE_FIELDS = {'name', 'severity', 'zones', 'question', 'question_ids', 'critical', 'answer', 'repeat', 'window_days'}
+
+Rule = namedtuple('Rule', ['name', 'severity', 'answers', 'repeat', 'window_days'])
+
+logger = logging.getLogger(__name__)
+
+
+class RuleError(ValueError):
+    pass
+
+
+def load_rules(path=ALERT_RULES_FILE):
+    if not path:
+        return DEFAULT_RULES
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compile_rules(rules, registry):
+    """
+    Resolve every rule to the questions it applies to, once.
+
+    Returns {question id: (Rule, ...)}, so checking a submitted answer is a
+    single dict lookup however many rules there are.
+    """
+    index = {}
+    for spec in rules:
+        unknown = set(spec) - RULE_FIELDS
+        if unknown:
+            raise RuleError(f"Rule {spec.get('name')!r} has unknown fields: {', '.join(sorted(unknown))}")
+        if not spec.get('name'):
+            raise RuleError("Every rule needs a name")
+        severity = spec.get('severity', "warning")
+        if severity not in SEVERITIES:
+            raise RuleError(f"Rule {spec['name']!r} has unknown severity {severity!r}")
+        answers = spec.get('answer', "No")
+        rule = Rule(
+            spec['name'],
+            severity,
+            frozenset([answers] if isinstance(answers, str) else answers),
+            int(spec.get('repeat', 1)),
+            int(spec.get('window_days', 30)),
+        )
+
+        pattern = re.compile(spec['question'], re.IGNORECASE) if spec.get('question') else None
+        zones = {normalize_zone(zone) for zone in spec.get('zones', ())}
+        question_ids = set(spec.get('question_ids', ()))
+        for zone, questions in registry.zones.items():
+            if zones and normalize_zone(zone) not in zones:
+                continue
+            for question in questions:
+                if question_ids and question.id not in question_ids:
+                    continue
+                if pattern is not None and not pattern.search(question.text):
+                    continue
+                if spec.get('critical') and question_weight(question.id, question.text) < CRITICAL_WEIGHT:
+                    continue
+                index.setdefault(question.id, []).append(rule)
+    return {question_id: tuple(matched) for question_id, matched in index.items()}
+
+
+class AlertEngine:
+    """
+    Check each submitted zone against the compiled rules and put new alerts
+    in the store's outbox.
+
+    Only the submitted rows are looked at. Repeat rules add one indexed count
+    per matching answer, so the cost does not grow with the audit history.
+    """
+
+    def __init__(self, store, rules=None, registry=None, log_path=ALERT_LOG):
+        self.store = store
+        self.log_path = log_path
+        self.rules = compile_rules(load_rules() if rules is None else rules, registry or get_checklist_registry())
+
+    def evaluate(self, audit_id, zone, rows, auditor=None, today=None):
+        """
+        Return the alerts this submit raised for the first time.
+        """
+        today = today or date.today()
+        candidates = []
+        for row in rows:
+            answer = row.get('Answer')
+            for rule in self.rules.get(row.get('Question ID'), ()):
+                if answer not in rule.answers:
+                    continue
+                question = row.get('Question') or row.get('Food Production Zone')
+                message = f"{zone}: \"{question}\" answered {answer}"
+                if rule.repeat > 1:
+                    since = today - timedelta(days=rule.window_days - 1)
+                    count = self.store.answer_count(zone, row['Question ID'], rule.answers, since)
+                    if count < rule.repeat:
+                        continue
+                    message += f", {count} times in the last {rule.window_days} days"
+                candidates.append({
+                    'audit_id': audit_id,
+                    'zone': zone,
+                    'question_id': row['Question ID'],
+                    'rule': rule.name,
+                    'severity': rule.severity,
+                    'message': message,
+                    'auditor': auditor,
+                })
+                break
+
+        if not candidates:
+            return []
+        alerts = self.store.add_alerts(candidates)
+        self._log(alerts)
+        return alerts
+
+    def _log(self, alerts):
+        for alert in alerts:
+            logger.warning("%s alert, %s: %s", alert['severity'], alert['rule'], alert['message'])
+        if not alerts or not self.log_path:
+            return
+        directory = os.path.dirname(self.log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            for alert in alerts:
+                f.write(json.dumps(alert) + "\n")
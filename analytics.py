@@ -0,0 +1,21 @@
+from collections import namedtuple
+
+# Everything the Analysis page plots, derived from one table of tallies
+AuditSummary = namedtuple('AuditSummary', ['tallies', 'answers', 'by_location', 'by_question'])
+
+
+def summarize(tallies):
+    """
+    Build the per-location and per-question answer tables from the grouped
+    tallies returned by AuditStore.tallies.
+    """
+    answers = tallies.groupby('Answer')['Count'].sum().sort_values(ascending=False)
+
+    by_location = tallies.pivot_table(index='Location', columns='Answer', values='Count', aggfunc='sum', fill_value=0)
+    by_location = by_location.loc[by_location.sum(axis=1).sort_values(ascending=False).index]
+
+    zone_tallies = tallies[tallies['Section'] == 'Food Production Zone']
+    by_question = zone_tallies.pivot_table(index='Question', columns='Answer', values='Count', aggfunc='sum', fill_value=0)
+    by_question = by_question.loc[by_question.sum(axis=1).sort_values(ascending=False).index]
+
+    return AuditSummary(tallies, answers, by_location, by_question)
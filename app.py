@@ -1,19 +1,42 @@
+import os
+from datetime import date, timedelta
+
 import streamlit as st
-import pandas as pd
-import base64
-import matplotlib.pyplot as plt
-import seaborn as sns
-from tempfile import NamedTemporaryFile
-from docx import Document
+
+from analytics import summarize
+from audit_store import (
+    ACTION_STATUSES, EXPORT_COLUMNS, FRAME_SORT_COLUMNS, ActionError, AuditStore, MissingAudit, ZoneConflict,
+)
+from checklists import get_checklist_registry
+from images import ImagePipeline
+from photo_store import PhotoStore
+from profiling import MODES, RerunProfiler, profiled, stage
+from scoring import get_question_weights, percentage
+from session_memory import SESSION_BUDGET, SessionMeter, state_bytes
+from site_config import SiteConfigWatcher
+
+# pandas, Altair, pyarrow, matplotlib and python-docx are imported inside the
+# Analysis and Comments page functions that use them, so the Home and Audit
+# pages never pay for loading them.
+
+# Streamlit releases with fragments rerun only the zone being edited
+zone_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
 
 # Auditor authentication
 def authenticate_auditor():
     auditor_name = st.text_input("Enter your name:", "")
 
-    if auditor_name.lower() in ["callistus kyire", "iddriss nyande", "lovia", "felix"]:
+    config = get_site_config()
+    # Already signed in under this name, the password hash is slow on
+    # purpose and is not checked again on every rerun
+    if auditor_name and st.session_state.get('auditor_name') == auditor_name.lower():
+        st.text_input("Enter password:", type="password")
+        return auditor_name.lower()
+
+    if config.auditor(auditor_name) is not None:
         password = st.text_input("Enter password:", type="password")
 
-        if password == "ACL101":
+        if config.authenticate(auditor_name, password):
             st.session_state['auditor_name'] = auditor_name.lower()
             return auditor_name.lower()
 
@@ -44,457 +67,576 @@ def audit_page():
 
     auditor_name = st.session_state['auditor_name']
     assigned_food_production_zones = get_assigned_food_production_zones(auditor_name)
-    audit_data = []
+    locations = get_site_config().locations_for(auditor_name)
+
+    choose_audit_session()
 
      # Title Page
     st.header("Auditor Information")
-    client_site = st.text_input("Client / Site:", "")
-    location = st.text_input("Location:", "")
-    address = st.text_input("Position at ACL:", "")
-    conducted_on_date = st.date_input("Conducted on:", value=None)
+    if st.session_state.get('joined_audit'):
+        # The audit's owner keeps the header, contributors only see it
+        audit = get_audit_store().get_audit(st.session_state['audit_id']) or {}
+        st.write(f"Client / Site: {audit.get('client_site') or '-'}")
+        st.write(f"Location: {audit.get('location') or '-'}")
+        st.write(f"Position at ACL: {audit.get('position') or '-'}")
+        st.write(f"Conducted on: {audit.get('conducted_on') or '-'}")
+        st.write(f"Prepared by: {audit.get('auditor', '').title()}")
+    else:
+        load_audit_header()
+        client_site = st.text_input("Client / Site:", key="header_client_site")
+        location = st.text_input("Location:", key="header_location")
+        address = st.text_input("Position at ACL:", key="header_position")
+        conducted_on_date = st.date_input("Conducted on:", key="header_conducted_on")
 
-    prepared_by = auditor_name.title()
+        prepared_by = auditor_name.title()
+        set_audit_header(client_site, location, address, conducted_on_date)
 
     st.write("---")
 
     select_box = st.selectbox("Select:", ["Location", "Food Production Zone"])
+    offline = st.toggle("Offline capture", help="Keep answers on this device and sync them in batches, for zones with poor Wi-Fi.")
 
-    if select_box == "Location":
-        for location in ["Exterior", "Interior"]:
+    if offline:
+        offline_audit(locations if select_box == "Location" else assigned_food_production_zones)
+    elif select_box == "Location":
+        for location in locations:
             with st.expander(location):
-                location_data = conduct_audit_location(location)
-                audit_data.extend(location_data)
+                conduct_audit_location(location)
     elif select_box == "Food Production Zone":
         for zone in assigned_food_production_zones:
-            location_data = conduct_audit_food_production_zone(zone)
-            if location_data:
-                with st.expander(zone):
-                    audit_data.extend(location_data)
-
-    st.session_state['audit_data'] = audit_data
+            with st.expander(zone):
+                conduct_audit_food_production_zone(zone)
 
 def get_assigned_food_production_zones(auditor_name):
-    assignments = {
-        "callistus kyire": ["Old Lay-up", "Tray Set-up", "Bakery", "Cooked Food Fridge", "Dish Wash-Up Bay"],
-        "iddriss nyande": ["Entrance", "Receiving Bay", "Loading Bay", "Old Lay-up Holding Room"],
-        "lovia": ["Dry Goods Store", "Hot Kitchen", "Dishing Room", "Butchery", "Pots and Pans Washing Bay"],
-        "felix": ["Blast Freezers", "Deep Freezer", "Cold Room"]
+    return get_site_config().zones_for(auditor_name)
+
+
+@st.cache_resource
+def get_config_watcher():
+    # Parsed once per process, then reloaded by the watcher when the file changes
+    return SiteConfigWatcher(registry=get_checklists()).start()
+
+
+def get_site_config():
+    return get_config_watcher().config
+
+
+@st.cache_resource
+def get_checklists():
+    # Compile the checklist tables and question weights once per process
+    get_question_weights()
+    return get_checklist_registry()
+
+
+@st.cache_resource
+def get_photo_store():
+    return PhotoStore()
+
+
+@st.cache_resource
+def get_audit_store():
+    return AuditStore()
+
+
+# How far back audits can still be joined by another auditor
+OPEN_AUDIT_DAYS = 1
+
+
+def choose_audit_session():
+    """
+    Start a new audit or join one a colleague has open, so several auditors
+    can fill in their zones of the same site audit at the same time.
+    """
+    audits = get_audit_store().open_audits(date.today() - timedelta(days=OPEN_AUDIT_DAYS))
+    labels = {
+        row['id']: f"#{row['id']} {row['client_site'] or 'Unspecified site'}, started by {row['auditor'].title()}"
+        for row in audits
     }
-    return assignments.get(auditor_name.lower(), [])
+    current = st.session_state.get('audit_id')
+    if current is not None and current not in labels:
+        labels[current] = f"#{current}"
+    options = {"Start a new audit": None}
+    options.update({label: audit_id for audit_id, label in labels.items()})
+    choice = options[st.selectbox("Audit session:", list(options), index=list(options.values()).index(current))]
+    if choice == current:
+        return
 
+    st.session_state.pop('zone_versions', None)
+    st.session_state.pop('finished_zones', None)
+    st.session_state.pop('audit_header', None)
+    if choice is None:
+        st.session_state.pop('audit_id', None)
+        st.session_state.pop('joined_audit', None)
+        # A new audit starts with an empty header
+        for key in HEADER_KEYS:
+            st.session_state.pop(key, None)
+    else:
+        audit = get_audit_store().get_audit(choice)
+        st.session_state['audit_id'] = choice
+        st.session_state['joined_audit'] = audit is not None and audit['auditor'] != st.session_state['auditor_name']
 
-def conduct_audit_location(location):
-    st.write(f"Conducting audit for {location.title()}")
 
-    questions = get_questions_for_location(location)
+HEADER_KEYS = ('header_client_site', 'header_location', 'header_position', 'header_conducted_on')
+
 
-    location_data = []
+def load_audit_header():
+    """
+    Fill the header inputs from the stored audit whenever they do not show
+    it yet, e.g. after reopening it or coming back from another page, so
+    editing one field never blanks the others.
+    """
+    audit_id = st.session_state.get('audit_id')
+    if audit_id is None:
+        st.session_state.pop('header_audit_id', None)
+        for key in HEADER_KEYS:
+            st.session_state.setdefault(key, None if key == 'header_conducted_on' else "")
+        return
+    if st.session_state.get('header_audit_id') == audit_id and all(key in st.session_state for key in HEADER_KEYS):
+        return
 
-    for i, question in enumerate(questions):
-        answer = st.selectbox(question['question'], ["Select Option", "Yes", "No", "N/A"], key=f"{location}_{i}_{question['question']}")
-        location_data.append({
-            'Location': location,
-            'Question': question['question'],
-            'Answer': answer
-        })
+    audit = get_audit_store().get_audit(audit_id) or {}
+    header = (
+        audit.get('client_site') or "",
+        audit.get('location') or "",
+        audit.get('position') or "",
+        date.fromisoformat(audit['conducted_on']) if audit.get('conducted_on') else None,
+    )
+    for key, value in zip(HEADER_KEYS, header):
+        st.session_state[key] = value
+    st.session_state['header_audit_id'] = audit_id
+    st.session_state['audit_header'] = header
 
-    if st.button(f"Attach photos for {location}", key=f"attach_photos_{location}"):
-        uploaded_files = st.file_uploader(f"Upload photos for {location}", accept_multiple_files=True, key=f"upload_photos_{location}")
 
-        for uploaded_file in uploaded_files:
-            file_bytes = uploaded_file.getvalue()
-            file_base64 = base64.b64encode(file_bytes).decode('utf-8')
-            location_data.append({
-                'Location': location,
-                'Photo': file_base64
-            })
+def set_audit_header(client_site, location, position, conducted_on):
+    """
+    Remember the auditor information and keep a saved audit in sync with it.
+    """
+    header = (client_site, location, position, conducted_on)
+    # Nothing is written until this session has seen the header once, so
+    # reopening an audit does not blank it out
+    if 'audit_id' in st.session_state and 'audit_header' in st.session_state and st.session_state['audit_header'] != header:
+        get_audit_store().update_audit(st.session_state['audit_id'], *header)
+    st.session_state['audit_header'] = header
 
-    comments = st.text_area(f"Comments for {location}", key=f"comments_{location}")
-    if comments:
-        location_data.append({
-            'Location': location,
-            'Comments': comments
-        })
 
-    if not any('Comments' in item for item in location_data):
-        location_data.append({
-            'Location': location,
-            'Comments': None
-        })
+def forget_audit():
+    # Drop everything this session knows about its audit, the next submit
+    # starts a new one
+    for key in ('audit_id', 'audit_header', 'header_audit_id', 'finished_zones', 'zone_versions', 'joined_audit'):
+        st.session_state.pop(key, None)
 
-    if st.button("Submit", key=f"submit_{location}"):
-        st.session_state['audit_data'].extend(location_data)
-        st.success("Data submitted successfully!")
 
-    # Button to clear the entry
-    if st.button("Clear Entry", key=f"clear_{location}"):
-        st.session_state['audit_data'] = [entry for entry in st.session_state['audit_data'] if entry['Location'] != location]
-        st.info("Entry cleared successfully!")
+def get_current_audit_id():
+    """
+    Return the audit for this session, creating it on the first submit.
+    """
+    if 'audit_id' not in st.session_state:
+        header = st.session_state.get('audit_header', (None, None, None, None))
+        st.session_state['audit_id'] = get_audit_store().create_audit(
+            st.session_state['auditor_name'], *header, site=get_auditor_site(),
+        )
+    return st.session_state['audit_id']
 
-    return location_data
 
-def conduct_audit_food_production_zone(zone):
-    st.write(f"Conducting audit for {zone}")
+@st.cache_resource
+def get_image_pipeline():
+    return ImagePipeline(get_photo_store())
 
-    questions = get_questions_for_food_production_zone(zone)
 
-    location_data = []
+@profiled()
+def store_photos(location, uploaded_files):
+    """
+    Save uploaded photos to the photo store and return their audit rows.
 
-    for i, question in enumerate(questions):
-        answer = st.selectbox(question['question'], ["Select Option", "Yes", "No", "N/A"], key=f"{zone}_fpz_{i}_{question['question']}")
-        location_data.append({
-            'Location': zone,
-            'Food Production Zone': question['question'],
-            'Answer': answer
-        })
+    Thumbnails and previews are made in the background, so this returns as
+    soon as the files are on disk.
+    """
+    photo_store = get_photo_store()
+    pipeline = get_image_pipeline()
+    rows = []
+    for uploaded_file in uploaded_files or []:
+        metadata = photo_store.put(uploaded_file)
+        pipeline.submit(metadata['Photo'])
+        rows.append({'Location': location, **metadata})
+    return rows
 
-    if st.button(f"Attach photos for {zone}", key=f"attach_photos_{zone}"):
-        uploaded_files = st.file_uploader(f"Upload photos for {zone}", accept_multiple_files=True, key=f"upload_photos_{zone}")
 
-        for uploaded_file in uploaded_files:
-            file_bytes = uploaded_file.getvalue()
-            file_base64 = base64.b64encode(file_bytes).decode('utf-8')
-            location_data.append({
-                'Location': zone,
-                'Photo': file_base64
-            })
+def upload_key(zone):
+    # Bumped when a finished zone's uploads are released, which gives the
+    # zone a fresh, empty uploader
+    return f"upload_photos_{zone}_{st.session_state.get('upload_rounds', {}).get(zone, 0)}"
 
-    comments = st.text_area(f"Comments for {zone}", key=f"comments_{zone}")
-    if comments:
-        location_data.append({
-            'Location': zone,
-            'Comments': comments
-        })
 
-    if not any('Comments' in item for item in location_data):
-        location_data.append({
-            'Location': zone,
-            'Comments': None
-        })
+@st.cache_resource
+def get_session_meter():
+    return SessionMeter()
 
-    if st.button("Submit", key=f"submit_{zone}"):
-        st.session_state['audit_data'].extend(location_data)
-        st.success("Data submitted successfully!")
 
-    # Button to clear the entry
-    if st.button("Clear Entry", key=f"clear_{zone}"):
-        st.session_state['audit_data'] = [entry for entry in st.session_state['audit_data'] if entry['Location'] != zone]
-        st.info("Entry cleared successfully!")
+def enforce_session_budget():
+    """
+    Record this session's state size and, once it is over SESSION_BUDGET,
+    release the in-memory uploads of zones that were already submitted.
+
+    Submitted answers and photos are already in the audit and photo stores,
+    so only the active zone's unsaved input has to stay in memory.
+    """
+    from streamlit import runtime
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    session_id = ctx.session_id if ctx is not None else None
+    nbytes = sum(state_bytes(st.session_state).values())
+    if nbytes > SESSION_BUDGET:
+        rounds = st.session_state.setdefault('upload_rounds', {})
+        for zone in st.session_state.get('finished_zones', []):
+            key = upload_key(zone)
+            uploaded_files = st.session_state.get(key) or []
+            if not uploaded_files:
+                continue
+            # remove_file is only on the default MemoryUploadedFileManager,
+            # it is not part of the UploadedFileManager protocol. Other
+            # managers keep the bytes until the session ends, and dropping
+            # the widget state below still releases this session's copy.
+            remove_file = None
+            if runtime.exists() and session_id is not None:
+                remove_file = getattr(runtime.get_instance().uploaded_file_mgr, 'remove_file', None)
+            if remove_file is not None:
+                for uploaded_file in uploaded_files:
+                    remove_file(session_id, uploaded_file.file_id)
+            del st.session_state[key]
+            rounds[zone] = rounds.get(zone, 0) + 1
+        nbytes = sum(state_bytes(st.session_state).values())
+    get_session_meter().record(session_id, nbytes)
+    return nbytes
+
+
+def seen_zone_version(zone):
+    """
+    Remember the version of a zone this auditor is looking at, the first
+    time the zone is shown.
+    """
+    versions = st.session_state.setdefault('zone_versions', {})
+    if zone not in versions and 'audit_id' in st.session_state:
+        versions[zone] = get_audit_store().zone_version(st.session_state['audit_id'], zone)
+    return versions.get(zone)
+
+
+def commit_zone(zone, rows):
+    """
+    Save a zone unless another auditor committed it after this auditor last
+    saw it. After a conflict, submitting again overwrites theirs.
+    """
+    versions = st.session_state.setdefault('zone_versions', {})
+    try:
+        versions[zone] = get_audit_store().save_zone(
+            get_current_audit_id(), zone, rows,
+            auditor=st.session_state['auditor_name'], expected_version=versions.get(zone),
+        )
+    except ZoneConflict as conflict:
+        versions[zone] = conflict.version
+        st.warning(f"{zone} was submitted by {(conflict.auditor or 'another auditor').title()} at {conflict.committed_at} UTC. Submit again to replace their answers.")
+        return False
+    except MissingAudit:
+        forget_audit()
+        st.error("This audit was removed by its owner. Submit again to save your answers in a new audit.")
+        return False
+
+    finished_zones = st.session_state.setdefault('finished_zones', [])
+    if zone not in finished_zones:
+        finished_zones.append(zone)
+    for alert in raise_alerts(zone, rows):
+        (st.error if alert['severity'] == "critical" else st.warning)(f"{alert['rule']}: {alert['message']}")
+    return True
+
+
+@st.cache_resource
+def get_alert_engine():
+    from alerts import AlertEngine
+
+    return AlertEngine(get_audit_store(), registry=get_checklists())
+
+
+@profiled()
+def raise_alerts(zone, rows):
+    """
+    Run the alert rules over a zone that was just saved.
+    """
+    return get_alert_engine().evaluate(st.session_state['audit_id'], zone, rows, auditor=st.session_state['auditor_name'])
+
+
+def discard_zone(zone):
+    if 'audit_id' not in st.session_state:
+        return
+    try:
+        st.session_state.setdefault('zone_versions', {})[zone] = get_audit_store().clear_zone(
+            st.session_state['audit_id'], zone, auditor=st.session_state['auditor_name'],
+        )
+    except MissingAudit:
+        # Nothing left to clear, the whole audit is gone
+        forget_audit()
+
+
+def offline_audit(zones):
+    """
+    Capture answers in the browser and apply them in compressed batches when
+    the connection allows, instead of a form round-trip per zone.
+    """
+    from offline_queue import BatchError, batch_rows, decode_batch, offline_capture
+
+    auditor_name = st.session_state['auditor_name']
+    synced = st.session_state.setdefault('synced_batches', [])
+    batch = offline_capture(
+        auditor_name,
+        {zone: get_questions_for_food_production_zone(zone) for zone in zones},
+        audit_id=st.session_state.get('audit_id'),
+        acked=synced,
+        key="offline_queue",
+    )
+    if batch is None or batch['batch_id'] in synced:
+        return
+
+    try:
+        entries = decode_batch(batch)
+    except BatchError as exc:
+        st.error(str(exc))
+        return
+
+    store = get_audit_store()
+    if 'audit_id' not in st.session_state and batch.get('audit_id'):
+        # Reconnected in a new session, carry on with the audit the answers
+        # were queued for
+        audit = store.get_audit(batch['audit_id'])
+        if audit is not None:
+            st.session_state['audit_id'] = audit['id']
+            st.session_state['joined_audit'] = audit['auditor'] != auditor_name
+    zones = batch_rows(entries, get_site_config().site_checklists.get(get_auditor_site(), {}))
+    try:
+        applied = store.apply_batch(batch['batch_id'], get_current_audit_id(), auditor_name, zones)
+    except MissingAudit:
+        # The audit was removed while the answers were queued, keep them
+        # in a new audit rather than losing them
+        forget_audit()
+        st.toast("This audit was removed by its owner, the queued answers were saved in a new audit.", icon="⚠️")
+        applied = store.apply_batch(batch['batch_id'], get_current_audit_id(), auditor_name, zones)
+    for zone, rows in zones.items():
+        st.session_state.get('zone_versions', {}).pop(zone, None)
+        if applied:
+            # A toast, unlike an inline message, outlives the rerun below
+            for alert in raise_alerts(zone, rows):
+                st.toast(f"{alert['rule']}: {alert['message']}", icon="🚨")
+    synced.append(batch['batch_id'])
+    del synced[:-20]
+    # Rerun so the client gets the acknowledgement and drops the batch
+    st.rerun()
+
+
+@profiled()
+def show_photo_thumbnails(location):
+    """
+    Show thumbnails of the photos saved for a location in this audit.
+    """
+    if 'audit_id' not in st.session_state:
+        return
+    photos = get_audit_store().photos(st.session_state['audit_id'], zone=location)
+    if not photos:
+        return
+
+    pipeline = get_image_pipeline()
+    thumbnails = [pipeline.path(photo['digest']) for photo in photos]
+    ready = [path for path in thumbnails if path]
+    if ready:
+        st.image(ready, width=128)
+    if len(ready) < len(thumbnails):
+        st.caption(f"{len(thumbnails) - len(ready)} photo(s) still processing.")
 
-    return location_data
 
+@zone_fragment
+@profiled()
 def conduct_audit_location(location):
     st.write(f"Conducting audit for {location.title()}")
 
     questions = get_questions_for_location(location)
+    seen_zone_version(location)
 
-    location_data = []
+    # Answers are only sent when the form is submitted, so answering a
+    # question no longer reruns the whole page
+    with stage("render form"), st.form(key=f"form_{location}"):
+        location_data = []
 
-    for i, question in enumerate(questions):
-        answer = st.selectbox(question['question'], ["Yes", "No", "N/A"], key=f"{location}_{i}_{question['question']}")
-        location_data.append({
-            'Location': location,
-            'Question': question['question'],
-            'Answer': answer
-        })
+        for question in questions:
+            answer = st.selectbox(question.text, ["Yes", "No", "N/A"], key=f"{location}_{question.id}")
+            location_data.append({
+                'Location': location,
+                'Question ID': question.id,
+                'Question': question.text,
+                'Answer': answer
+            })
 
-    if st.button(f"Attach photos for {location}", key=f"attach_photos_{location}"):
-        uploaded_files = st.file_uploader(f"Upload photos for {location}", accept_multiple_files=True, key=f"upload_photos_{location}")
+        uploaded_files = st.file_uploader(f"Upload photos for {location}", accept_multiple_files=True, key=upload_key(location))
 
-        for uploaded_file in uploaded_files:
-            file_bytes = uploaded_file.getvalue()
-            file_base64 = base64.b64encode(file_bytes).decode('utf-8')
+        comments = st.text_area(f"Comments for {location}", key=f"comments_{location}")
+        if comments:
             location_data.append({
                 'Location': location,
-                'Photo': file_base64
+                'Comments': comments
             })
 
-    comments = st.text_area(f"Comments for {location}", key=f"comments_{location}")
-    if comments:
-        location_data.append({
-            'Location': location,
-            'Comments': comments
-        })
+        if not any('Comments' in item for item in location_data):
+            location_data.append({
+                'Location': location,
+                'Comments': None
+            })
 
-    if not any('Comments' in item for item in location_data):
-        location_data.append({
-            'Location': location,
-            'Comments': None
-        })
+        submitted = st.form_submit_button("Submit")
+        cleared = st.form_submit_button("Clear Entry")
 
-    if st.button("Submit", key=f"submit_{location}"):
-        st.session_state['audit_data'].extend(location_data)
-        st.success("Data submitted successfully!")
+    if submitted:
+        location_data.extend(store_photos(location, uploaded_files))
+        if commit_zone(location, location_data):
+            st.success("Data submitted successfully!")
 
     # Button to clear the entry
-    if st.button("Clear Entry", key=f"clear_{location}"):
-        st.session_state['audit_data'] = [entry for entry in st.session_state['audit_data'] if entry['Location'] != location]
+    if cleared:
+        discard_zone(location)
         st.info("Entry cleared successfully!")
 
+    show_photo_thumbnails(location)
+
     return location_data
 
+@zone_fragment
+@profiled()
 def conduct_audit_food_production_zone(zone):
     st.write(f"Conducting audit for {zone}")
 
     questions = get_questions_for_food_production_zone(zone)
+    seen_zone_version(zone)
 
-    location_data = []
+    # Answers are only sent when the form is submitted, so answering a
+    # question no longer reruns the whole page
+    with stage("render form"), st.form(key=f"form_{zone}"):
+        location_data = []
 
-    for i, question in enumerate(questions):
-        answer = st.selectbox(question['question'], ["Yes", "No", "N/A"], key=f"{zone}_fpz_{i}_{question['question']}")
-        location_data.append({
-            'Location': zone,
-            'Food Production Zone': question['question'],
-            'Answer': answer
-        })
+        for question in questions:
+            answer = st.selectbox(question.text, ["Yes", "No", "N/A"], key=f"{zone}_fpz_{question.id}")
+            location_data.append({
+                'Location': zone,
+                'Question ID': question.id,
+                'Food Production Zone': question.text,
+                'Answer': answer
+            })
 
-    if st.button(f"Attach photos for {zone}", key=f"attach_photos_{zone}"):
-        uploaded_files = st.file_uploader(f"Upload photos for {zone}", accept_multiple_files=True, key=f"upload_photos_{zone}")
+        uploaded_files = st.file_uploader(f"Upload photos for {zone}", accept_multiple_files=True, key=upload_key(zone))
 
-        for uploaded_file in uploaded_files:
-            file_bytes = uploaded_file.getvalue()
-            file_base64 = base64.b64encode(file_bytes).decode('utf-8')
+        comments = st.text_area(f"Comments for {zone}", key=f"comments_{zone}")
+        if comments:
             location_data.append({
                 'Location': zone,
-                'Photo': file_base64
+                'Comments': comments
             })
 
-    comments = st.text_area(f"Comments for {zone}", key=f"comments_{zone}")
-    if comments:
-        location_data.append({
-            'Location': zone,
-            'Comments': comments
-        })
+        if not any('Comments' in item for item in location_data):
+            location_data.append({
+                'Location': zone,
+                'Comments': None
+            })
 
-    if not any('Comments' in item for item in location_data):
-        location_data.append({
-            'Location': zone,
-            'Comments': None
-        })
+        submitted = st.form_submit_button("Submit")
+        cleared = st.form_submit_button("Clear Entry")
 
-    if st.button("Submit", key=f"submit_{zone}"):
-        st.session_state['audit_data'].extend(location_data)
-        st.success("Data submitted successfully!")
+    if submitted:
+        location_data.extend(store_photos(zone, uploaded_files))
+        if commit_zone(zone, location_data):
+            st.success("Data submitted successfully!")
 
     # Button to clear the entry
-    if st.button("Clear Entry", key=f"clear_{zone}"):
-        st.session_state['audit_data'] = [entry for entry in st.session_state['audit_data'] if entry['Location'] != zone]
+    if cleared:
+        discard_zone(zone)
         st.info("Entry cleared successfully!")
 
+    show_photo_thumbnails(zone)
+
     return location_data
 
 
-def get_questions_for_location(location):
-    if location == "Exterior":
-        questions = [
-            {'question': 'Is signage in place, in good repair and clearly visible?'},
-            {'question': 'Does the landscaping appear to be clean and well maintained?'},
-            {'question': 'Do the sidewalks appear to be clean and in good condition?'},
-            {'question': 'Does the building appear to be clean and in good condition? (including windows)'}
-        ]
-
-        return questions
-
-    elif location == "Interior":
-        questions = [
-            {'question': 'Are the restrooms clean and stocked? Free of odor? Seats Secure?'},
-            {'question': 'Are the floors, tables and seating clean and in good condition?'},
-            {'question': 'Are the trash containers clean and in good condition? Liners tucked? No odors?'},
-            {'question': 'Are the front corridors clean and clutter free?'},
-            {'question': 'Is all lighting working and in good repair?'},
-            {'question': 'Is the area clean and well maintained?'}
-        ]
-
-        return questions
+def get_auditor_site():
+    return get_site_config().site_for(st.session_state.get('auditor_name', ''))
 
-    else:
-        return get_questions_for_food_production_zone(location)
+@profiled("question table")
+def get_questions_for_location(location):
+    # Locations and zones both map to their checklist in the auditor's site
+    return get_site_config().checklist(location, get_auditor_site()) or get_checklists().questions(location)
 
+@profiled("question table")
 def get_questions_for_food_production_zone(zone):
-    questions = {
-        "Entrance": [
-            {'question': 'Are floors clean, dry and in good condition?'},
-            {'question': 'Are entrance doors and latches working properly?'},
-            {'question': 'Is the hand washing station operational?'},
-            {'question': 'Are aisles free of obstructions?'},
-            {'question': 'Is the temperature within the acceptable range?'},
-            {'question': 'Are safety signs and instructions clearly visible?'},
-            {'question': 'Are entry and exit points well-marked and maintained?'},
-            {'question': 'Is there adequate lighting in the entrance area?'}
-        ],
-        "Old Lay-up": [
-            {'question': 'Is the holding room temperature maintained between 0-5 degrees Celsius?'},
-            {'question': 'Are portioned foods properly stored and labeled?'},
-            {'question': 'Is the room free of any signs of pest infestation?'},
-            {'question': 'Are hygiene protocols followed during food handling?'},
-            {'question': 'Is equipment clean and in good condition?'},
-            {'question': 'Are temperature logs regularly maintained and reviewed?'},
-            {'question': 'Are emergency exits and equipment accessible and functional?'},
-            {'question': 'Is there sufficient space for staff to work safely?'}
-        ],
-        "Dry Goods Store": [
-            {'question': 'Are dry goods properly stored in sealed containers?'},
-            {'question': 'Is the room well-ventilated to prevent moisture buildup?'},
-            {'question': 'Are allergens stored separately and clearly labeled?'},
-            {'question': 'Are shelves organized and free of spills?'},
-            {'question': 'Are pest control measures in place and effective?'},
-            {'question': 'Is there adequate space for maneuvering and storage?'},
-            {'question': 'Are spill containment measures in place and functional?'},
-            {'question': 'Is there a designated area for receiving and inspecting goods?'}
-        ],
-        "Hot kitchen": [
-            {'question': 'Are cooking utensils and equipment clean and sanitized?'},
-            {'question': 'Is food cooked to the required temperature?'},
-            {'question': 'Are staff following proper food safety protocols?'},
-            {'question': 'Are waste bins emptied regularly and kept covered?'},
-            {'question': 'Is the kitchen well-ventilated to remove cooking odors?'},
-            {'question': 'Are cooking surfaces and equipment free of grease buildup?'},
-            {'question': 'Is there sufficient space for staff movement and workflow?'},
-            {'question': 'Are emergency shutdown procedures clearly posted and understood?'}
-        ],
-        "Dishing Room": [
-            {'question': 'Is food properly cooled before dishing?'},
-            {'question': 'Are disposable bowls stored in a clean and dry area?'},
-            {'question': 'Is there sufficient space to work safely?'},
-            {'question': 'Are staff wearing appropriate personal protective equipment?'},
-            {'question': 'Are hygiene standards maintained during food portioning?'},
-            {'question': 'Are portioning equipment and utensils clean and sanitized?'},
-            {'question': 'Is there adequate lighting for accurate food inspection?'},
-            {'question': 'Are food handling procedures clearly documented and followed?'}
-        ],
-        "Butchery": [
-            {'question': 'Is meat stored at the correct temperature?'},
-            {'question': 'Are cutting boards and knives sanitized between uses?'},
-            {'question': 'Is cross-contamination prevented during meat preparation?'},
-            {'question': 'Are meat products properly labeled with dates and types?'},
-            {'question': 'Are staff trained in safe meat handling practices?'},
-            {'question': 'Is there adequate ventilation to remove meat processing odors?'},
-            {'question': 'Are meat storage areas organized and free of spills?'},
-            {'question': 'Is there a designated area for waste disposal and storage?'}
-        ],
-        "Blast Freezers": [
-            {'question': 'Are blast freezers operating at the correct temperature?'},
-            {'question': 'Is food properly packaged before entering the blast freezer?'},
-            {'question': 'Are blast freezer doors kept closed when not in use?'},
-            {'question': 'Is there adequate space for airflow within the freezer?'},
-            {'question': 'Are temperature logs maintained and reviewed regularly?'},
-            {'question': 'Is there a backup power source in case of power failure?'},
-            {'question': 'Are blast freezer surfaces clean and free of ice buildup?'},
-            {'question': 'Are emergency alarms and shutdown procedures in place?'}
-        ],
-        "Deep Freezer": [
-            {'question': 'Is the deep freezer operating at the correct temperature?'},
-            {'question': 'Are frozen foods properly stored and organized?'},
-            {'question': 'Are freezer shelves free of frost buildup?'},
-            {'question': 'Is there a backup power source in case of a power outage?'},
-            {'question': 'Are temperature alarms functioning correctly?'},
-            {'question': 'Is there a designated area for inventory management?'},
-            {'question': 'Are freezer surfaces clean and free of spills?'},
-            {'question': 'Are freezer doors and seals well-maintained and functional?'}
-        ],
-        "Cold Room": [
-            {'question': 'Is the cold room temperature within the acceptable range?'},
-            {'question': 'Are fruits and vegetables stored separately to prevent cross-contamination?'},
-            {'question': 'Are shelves and storage bins clean and free of spills?'},
-            {'question': 'Is there adequate lighting in the cold room?'},
-            {'question': 'Are temperature logs maintained and reviewed regularly?'},
-            {'question': 'Is there a backup cooling system in case of failure?'},
-            {'question': 'Are emergency exits and pathways clearly marked and accessible?'},
-            {'question': 'Is there sufficient space for staff movement and storage?'}
-        ],
-        "Tray Set-up": [
-            {'question': 'Are food trays clean and sanitized before use?'},
-            {'question': 'Is food arranged on trays according to standard procedures?'},
-            {'question': 'Are tray assembly areas free of spills and debris?'},
-            {'question': 'Are trays inspected for quality before distribution?'},
-            {'question': 'Are trays stored in a clean and dry environment?'},
-            {'question': 'Are tray assembly areas well-ventilated and lit?'},
-            {'question': 'Are tray assembly procedures clearly documented and followed?'},
-            {'question': 'Are there designated areas for tray assembly and storage?'}
-        ],
-        "Bakery": [
-            {'question': 'Are baking ingredients stored in airtight containers?'},
-            {'question': 'Is baking equipment clean and in good working condition?'},
-            {'question': 'Are baked goods cooled properly before storage?'},
-            {'question': 'Are bakery products labeled with expiration dates?'},
-            {'question': 'Are hygiene standards maintained during baking operations?'},
-            {'question': 'Is there sufficient space for equipment maintenance and storage?'},
-            {'question': 'Are bakery waste disposal procedures followed properly?'},
-            {'question': 'Is there a backup plan for oven and mixer breakdowns?'}
-        ],
-        "Cooked Food Fridge": [
-            {'question': 'Is the fridge temperature maintained between 0-5 degrees Celsius?'},
-            {'question': 'Are cooked foods properly covered and labeled?'},
-            {'question': 'Is the fridge organized to prevent cross-contamination?'},
-            {'question': 'Are temperature logs maintained and reviewed regularly?'},
-            {'question': 'Are fridge shelves clean and free of spills?'},
-            {'question': 'Is there a backup cooling system in case of failure?'},
-            {'question': 'Is there sufficient space for inventory management?'},
-            {'question': 'Are emergency shutdown procedures clearly posted and understood?'}
-        ],
-       "Receiving Bay": [
-    {'question': 'Are temperature-sensitive products properly stored upon arrival?'},
-    {'question': 'Is there a designated area for receiving and inspecting goods?'},
-    {'question': 'Are incoming deliveries properly documented and logged?'},
-    {'question': 'Are hygiene standards maintained during product handling?'},
-    {'question': 'Is there adequate space for unloading and storage?'},
-    {'question': 'Are pest control measures in place and effective?'},
-    {'question': 'Is there a backup plan for receiving area breakdowns?'}
-],
-        "Loading Bay": [
-            {'question': 'Is the loading bay area clean and free of spills?'},
-            {'question': 'Are outgoing food products properly packaged and labeled?'},
-            {'question': 'Is there a designated area for loading food products onto vehicles?'},
-            {'question': 'Are loading schedules coordinated to minimize delays?'},
-            {'question': 'Are temperature-sensitive products monitored during loading?'},
-            {'question': 'Is there adequate space for vehicle maneuvering and parking?'},
-            {'question': 'Are safety procedures followed during loading operations?'},
-            {'question': 'Is there a backup plan for loading bay breakdowns?'}
-        ],
-        "Dish Wash-Up Bay": [
-            {'question': 'Are dishwashing machines properly maintained and sanitized?'},
-            {'question': 'Is there a backup plan in case of dishwasher failure?'},
-            {'question': 'Are dishwashing areas kept clean and organized?'},
-            {'question': 'Is there adequate ventilation to remove steam and heat?'},
-            {'question': 'Are dishwashing detergents and sanitizers used correctly?'},
-            {'question': 'Are dishes and utensils properly dried after washing?'},
-            {'question': 'Is there sufficient space for dish storage and drying racks?'},
-            {'question': 'Are dishwashing schedules followed consistently?'}
-        ],
-        "Pots and Pans Washing Bay": [
-            {'question': 'Are pots and pans properly cleaned and sanitized?'},
-            {'question': 'Are cleaning agents used according to safety guidelines?'},
-            {'question': 'Is there adequate ventilation in the washing bay?'},
-            {'question': 'Are washed pots and pans properly dried before storage?'},
-            {'question': 'Is there a backup plan in case of equipment failure?'},
-            {'question': 'Are cleaning schedules followed consistently?'},
-            {'question': 'Is there sufficient space for equipment maneuvering?'},
-            {'question': 'Are pot and pan storage areas clean and organized?'}
-        ],
-        "Old Lay-up Holding Room": [
-            {'question': 'Is the holding room temperature maintained between 0-5 degrees Celsius?'},
-            {'question': 'Are portioned foods properly stored and labeled?'},
-            {'question': 'Is the room free of any signs of pest infestation?'},
-            {'question': 'Are hygiene protocols followed during food handling?'},
-            {'question': 'Is equipment clean and in good condition?'},
-            {'question': 'Are temperature logs maintained and reviewed regularly?'},
-            {'question': 'Are emergency exits and equipment accessible and functional?'},
-            {'question': 'Is there sufficient space for staff to work safely?'}
-        ],
-        # Add more zones and their respective questions here
-    }
-    return questions.get(zone, [])
+    return get_site_config().checklist(zone, get_auditor_site()) or get_checklists().questions(zone)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def load_frame_count(version, audit_id, kinds, answer, zone):
+    # version is only part of the cache key, it changes on every store write
+    return get_audit_store().frame_count(kinds=kinds, answer=answer, audit_id=audit_id, zone=zone)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def load_frame_page(version, audit_id, kinds, answer, zone, sort, descending, offset, limit):
+    return get_audit_store().frame_page(
+        offset=offset, limit=limit, kinds=kinds, answer=answer, sort=sort, descending=descending,
+        audit_id=audit_id, zone=zone,
+    )
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_audit_summary(version, audit_id):
+    return summarize(get_audit_store().tallies(audit_id=audit_id))
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_photo_zones(version, audit_id):
+    return {row['zone']: row['photos'] for row in get_audit_store().photo_zones(audit_id)}
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_site_scores(version):
+    return [dict(row) for row in get_audit_store().site_scores()]
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def export_analysis_charts(version, audit_id, view):
+    """
+    Render the charts to PNG with matplotlib, only when an export is requested.
+    """
+    from charts import matplotlib_charts
+
+    return matplotlib_charts(load_audit_summary(version, audit_id), view)
 
 
 def analysis_page():
-    # Disable PyplotGlobalUseWarning
-    st.set_option('deprecation.showPyplotGlobalUse', False)
+    from charts import altair_charts
+
     st.title("Analysis Page")
-    if 'audit_data' in st.session_state:
-        audit_data = st.session_state['audit_data']
-        df = pd.DataFrame(audit_data)
-        
-        st.write(df)
+    open_alerts()
+    audit_id = st.session_state.get('audit_id')
+    scope = "All audits"
+    if audit_id is not None:
+        scope = st.radio("Show:", ["This audit", "All audits"], horizontal=True)
+    audit_filter = audit_id if scope == "This audit" else None
+
+    version = get_audit_store().version()
+    with stage("count frame"):
+        rows = load_frame_count(version, audit_filter, None, None, None)
+
+    if not rows:
+        st.write("No audit data found.")
+    else:
+        audit_data_grid(version, audit_filter)
+        photo_gallery(version, audit_filter)
+
+        compliance_scores(version, audit_filter)
+        if audit_filter is not None:
+            site_picture(audit_filter)
+            audit_changes(audit_filter)
+        compliance_trends()
         
         # Add your code for displaying visualizations
         st.subheader("Visualization")
@@ -502,141 +644,452 @@ def analysis_page():
         # Add select box for choosing between Location and Food Production Zone
         select_box = st.selectbox("Select:", ["Location", "Food Production Zone"])
         
-        # Add clear dataframe button
-        if st.button("Clear DataFrame"):
-            st.session_state.pop('audit_data', None)
+        # Add clear dataframe button, this only removes the current audit and
+        # only its owner may remove a shared one
+        if audit_id is not None and not st.session_state.get('joined_audit') and st.button("Clear DataFrame"):
+            get_audit_store().delete_audit(audit_id)
+            forget_audit()
             st.info("DataFrame cleared successfully!")
             return
-        
-        if select_box == "Location":
-            # Example visualization: Bar plot of audit results by location
-            st.write("Audit Results by Location:")
-            location_counts = df['Location'].value_counts()
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.barplot(x=location_counts.index, y=location_counts.values, ax=ax)
-            ax.set_xlabel('Location')
-            ax.set_ylabel('Count')
-            ax.set_xticklabels(ax.get_xticklabels(), rotation=45)
-            st.pyplot(fig)
-            
-            # Pie chart of audit results
-            st.write("Pie Chart of Audit Results:")
-            pie_data = df['Answer'].value_counts()
-            fig, ax = plt.subplots(figsize=(8, 8))
-            ax.pie(pie_data, labels=pie_data.index, autopct='%1.1f%%', startangle=140)
-            ax.axis('equal')
-            st.pyplot(fig)
-            
-            # Histogram of audit data
-            st.write("Histogram of Audit Data:")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.histplot(data=df, x='Location', hue='Answer', multiple='stack', ax=ax)
-            ax.set_xlabel('Location')
-            ax.set_ylabel('Count')
-            ax.set_xticklabels(ax.get_xticklabels(), rotation=45)
-            st.pyplot(fig)
-            
-            # Scatter plot of audit data
-            st.write("Scatter Plot of Audit Data:")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.scatterplot(data=df, x='Location', y='Answer', hue='Answer', ax=ax)
-            ax.set_xlabel('Location')
-            ax.set_ylabel('Answer')
-            ax.set_xticklabels(ax.get_xticklabels(), rotation=45)
-            st.pyplot(fig)
-            
-            # Box plot of audit data
-            st.write("Box Plot of Audit Data:")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.boxplot(data=df, x='Location', y='Answer', ax=ax)
-            ax.set_xlabel('Location')
-            ax.set_ylabel('Answer')
-            ax.set_xticklabels(ax.get_xticklabels(), rotation=45)
-            st.pyplot(fig)
-            
-        elif select_box == "Food Production Zone":
-            # Visualizations for Food Production Zone
-            # Bar plot of audit results by food production zone
-            st.write("Audit Results by Food Production Zone:")
-            fpz_counts = df['Food Production Zone'].value_counts()
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.barplot(x=fpz_counts.index, y=fpz_counts.values, ax=ax)
-            ax.set_xlabel('Food Production Zone')
-            ax.set_ylabel('Count')
-            ax.set_xticklabels(ax.get_xticklabels(), rotation=45)
-            st.pyplot(fig)
-            
-            # Pie chart of audit results by food production zone
-            st.write("Pie Chart of Audit Results by Food Production Zone:")
-            pie_data = df['Answer'].value_counts()
-            fig, ax = plt.subplots(figsize=(8, 8))
-            ax.pie(pie_data, labels=pie_data.index, autopct='%1.1f%%', startangle=140)
-            ax.axis('equal')
-            st.pyplot(fig)
-            
-            # Histogram of audit results by food production zone
-            st.write("Histogram of Audit Results by Food Production Zone:")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.histplot(data=df, x='Food Production Zone', hue='Answer', multiple='stack', ax=ax)
-            ax.set_xlabel('Food Production Zone')
-            ax.set_ylabel('Count')
-            ax.set_xticklabels(ax.get_xticklabels(), rotation=45)
-            st.pyplot(fig)
-            
-            # Box plot of audit results by food production zone
-            st.write("Box Plot of Audit Results by Food Production Zone:")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.boxplot(data=df, x='Food Production Zone', y='Answer', ax=ax)
-            ax.set_xlabel('Food Production Zone')
-            ax.set_ylabel('Answer')
-            ax.set_xticklabels(ax.get_xticklabels(), rotation=45)
-            st.pyplot(fig)
-            
-        if st.button("Download CSV"):
-            csv = df.to_csv(index=False)
-            b64 = base64.b64encode(csv.encode()).decode()
-            href = f'<a href="data:file/csv;base64,{b64}" download="audit_data.csv">Download CSV File</a>'
-            st.markdown(href, unsafe_allow_html=True)
+
+        with stage("altair charts"):
+            summary = load_audit_summary(version, audit_filter)
+            for title, chart in altair_charts(summary, select_box):
+                st.write(title)
+                st.altair_chart(chart, use_container_width=True)
+
+        with st.expander("Export charts as PNG"):
+            if st.button("Render PNG charts"):
+                for i, (title, image) in enumerate(export_analysis_charts(version, audit_filter, select_box)):
+                    st.download_button(title.rstrip(':'), image, file_name=f"chart_{i + 1}.png", mime="image/png", key=f"png_{i}")
+
+        export_page_data(audit_filter)
+
+
+GRID_PAGE_SIZES = [25, 50, 100, 250]
+GRID_KINDS = {"All rows": None, "Answers": ('Answers',), "Comments": ('Comments',), "Photos": ('Photos',)}
+
+
+@profiled()
+def audit_data_grid(version, audit_id):
+    """
+    Show the audit data one page at a time. Filtering, sorting and paging
+    happen in SQL, so only the visible rows are read and sent to the browser.
+    """
+    columns = st.columns(4)
+    kinds = GRID_KINDS[columns[0].selectbox("Rows:", list(GRID_KINDS), key="grid_kind")]
+    answer = columns[1].selectbox("Answer:", ["Any", "Yes", "No", "N/A"], key="grid_answer")
+    zone = columns[2].selectbox("Zone:", ["All zones", *get_site_config().zones], key="grid_zone")
+    sort = columns[3].selectbox("Sort by:", ["Entry order", *FRAME_SORT_COLUMNS], key="grid_sort")
+    answer = None if answer == "Any" else answer
+    zone = None if zone == "All zones" else zone
+    sort = None if sort == "Entry order" else sort
+
+    total = load_frame_count(version, audit_id, kinds, answer, zone)
+    columns = st.columns([1, 1, 2])
+    page_size = columns[0].selectbox("Rows per page:", GRID_PAGE_SIZES, index=1, key="grid_page_size")
+    pages = max(1, -(-total // page_size))
+    # Narrower filters can leave the kept page number past the last page. The
+    # default is seeded here too, a widget value= next to a session state
+    # write makes Streamlit warn.
+    st.session_state.setdefault('grid_page', 1)
+    if st.session_state['grid_page'] > pages:
+        st.session_state['grid_page'] = pages
+    page = columns[1].number_input("Page:", min_value=1, max_value=pages, key="grid_page")
+    descending = sort is not None and columns[2].toggle("Descending", key="grid_descending")
+
+    offset = (page - 1) * page_size
+    with stage("load frame page"):
+        df = load_frame_page(version, audit_id, kinds, answer, zone, sort, descending, offset, page_size)
+    st.dataframe(df, hide_index=True, use_container_width=True)
+    if total:
+        st.caption(f"Rows {offset + 1}-{offset + len(df)} of {total}")
+    else:
+        st.caption("No rows match these filters.")
+
+
+GALLERY_PAGE_SIZE = 24
+
+
+@profiled()
+def photo_gallery(version, audit_id):
+    """
+    Browse saved photos by zone. Nothing is read until a zone is picked, and
+    then only one page of thumbnails.
+    """
+    store = get_audit_store()
+    counts = load_photo_zones(version, audit_id)
+    if not counts:
+        return
+    with st.expander(f"Photo gallery ({sum(counts.values())} photos)"):
+        zone = st.selectbox("Gallery zone:", ["Choose a zone", *counts], key="gallery_zone")
+        if zone == "Choose a zone":
+            return
+        pages = max(1, -(-counts[zone] // GALLERY_PAGE_SIZE))
+        page = 1
+        st.session_state.setdefault('gallery_page', 1)
+        if st.session_state['gallery_page'] > pages:
+            st.session_state['gallery_page'] = pages
+        if pages > 1:
+            page = st.number_input("Gallery page:", min_value=1, max_value=pages, key="gallery_page")
+
+        photos = store.photos(audit_id, zone=zone, limit=GALLERY_PAGE_SIZE, offset=(page - 1) * GALLERY_PAGE_SIZE)
+        pipeline = get_image_pipeline()
+        thumbnails = [pipeline.path(photo['digest']) for photo in photos]
+        ready = [path for path in thumbnails if path]
+        if ready:
+            st.image(ready, width=128)
+        if len(ready) < len(thumbnails):
+            st.caption(f"{len(thumbnails) - len(ready)} photo(s) still processing.")
+
+
+@profiled()
+def compliance_scores(version, audit_id):
+    """
+    Show the running compliance scores, these are kept up to date on every submit.
+    """
+    import pandas as pd
+
+    from charts import score_chart
+
+    store = get_audit_store()
+    st.subheader("Compliance Scores")
+
+    if audit_id is not None:
+        score = percentage(store.audit_score(audit_id))
+        if score is not None:
+            st.metric("This audit", f"{score:.1f}%")
+        zone_scores = store.zone_scores(audit_id)
+        if zone_scores:
+            st.altair_chart(score_chart(zone_scores), use_container_width=True)
+
+    sites = load_site_scores(version)
+    if sites:
+        st.write("Scores by site:")
+        st.dataframe(
+            pd.DataFrame(
+                [
+                    (row['site'], 100.0 * row['earned'] / row['possible'] if row['possible'] else None,
+                     row['audits'], row['failed'], row['critical_failed'])
+                    for row in sites
+                ],
+                columns=['Site', 'Score (%)', 'Audits', 'Failed Checks', 'Critical Failures'],
+            ),
+            hide_index=True,
+        )
+
+
+@profiled()
+def open_alerts():
+    """
+    List unacknowledged alerts, newest first, for supervisors to act on.
+    """
+    alerts = get_audit_store().open_alerts()
+    if not alerts:
+        return
+    with st.expander(f"Open alerts ({len(alerts)})", expanded=True):
+        for alert in alerts:
+            columns = st.columns([5, 1])
+            columns[0].markdown(
+                f"**{alert['severity'].title()}: {alert['rule']}**  \n{alert['message']}  \n"
+                f"Audit #{alert['audit_id']}, {(alert['auditor'] or '-').title()}, {alert['created_at']} UTC"
+            )
+            if 'auditor_name' in st.session_state and columns[1].button("Acknowledge", key=f"ack_{alert['id']}"):
+                get_audit_store().acknowledge_alert(alert['id'], st.session_state['auditor_name'])
+                st.rerun()
+
+
+@profiled()
+def site_picture(audit_id):
+    """
+    Show every zone of a shared audit with who last submitted it. Zone scores
+    are updated as each zone is committed, so this is a single indexed read.
+    """
+    commits = get_audit_store().zone_commits(audit_id)
+    if not commits:
+        return
+    st.write("Site picture:")
+    st.dataframe(
+        [
+            {
+                'Zone': row['zone'],
+                'Submitted by': (row['auditor'] or '-').title(),
+                'Submitted at (UTC)': row['committed_at'],
+                'Score (%)': 100.0 * row['earned'] / row['possible'] if row['possible'] else None,
+                'Failed Checks': row['failed'],
+                'Critical Failures': row['critical_failed'],
+            }
+            for row in commits
+        ],
+        hide_index=True,
+    )
 
 
+@st.cache_resource
+def get_audit_differ():
+    from diffs import AuditDiffer
+
+    return AuditDiffer(get_audit_store())
+
+
+COMPARE_AUDIT_DAYS = 90
+
+
+@profiled()
+def audit_changes(audit_id):
+    """
+    Show what changed in each zone since the previous audit of that zone, or
+    since a chosen audit, with regressions first.
+    """
+    store = get_audit_store()
+    st.subheader("Changes Since Last Audit")
+    options = {"Previous audit of each zone": None}
+    for row in store.open_audits(date.today() - timedelta(days=COMPARE_AUDIT_DAYS)):
+        if row['id'] != audit_id:
+            day = row['conducted_on'] or row['created_at'][:10]
+            options[f"#{row['id']} {row['client_site'] or 'Unspecified site'}, {row['auditor'].title()}, {day}"] = row['id']
+    base_audit_id = options[st.selectbox("Compare with:", list(options), key="compare_audit")]
+
+    diffs = get_audit_differ().diff_audit(audit_id, base_audit_id)
+    if not diffs:
+        st.write("No earlier audit of these zones to compare with.")
+        return
+
+    regressions = sum(len(diff.regressions) for diff in diffs.values())
+    if regressions:
+        st.error(f"{regressions} check(s) failed that passed last time.")
+    for zone, diff in sorted(diffs.items(), key=lambda item: -len(item[1].regressions)):
+        if not (diff.regressions or diff.fixes or diff.changed or diff.new_comments or diff.new_photos):
+            st.caption(f"{zone}: no changes since audit #{diff.base_audit_id}.")
+            continue
+        st.markdown(f"**{zone}** (compared with audit #{diff.base_audit_id})")
+        for change in diff.regressions:
+            st.markdown(f":red[Regression: {change.question} ({change.before} → {change.after})]")
+        for change in diff.fixes:
+            st.markdown(f":green[Fixed: {change.question}]")
+        for change in diff.changed:
+            st.markdown(f"Changed: {change.question} ({change.before or 'not answered'} → {change.after})")
+        for comment in diff.new_comments:
+            st.markdown(f"New comment: {comment}")
+        if diff.new_photos:
+            st.caption(f"{len(diff.new_photos)} new photo(s).")
+
+
+@profiled()
+def compliance_trends():
+    """
+    Non-compliance over time, read from the daily and weekly rollups only.
+    """
+    from charts import trend_chart
+    from trends import load_trend
+
+    st.subheader("Trends")
+    period = st.radio("Trend period:", ["Weekly", "Daily"], horizontal=True)
+    periods = st.slider("Weeks to show:" if period == "Weekly" else "Days to show:", 2, 52 if period == "Weekly" else 90, 12)
+    zones = st.multiselect("Zones:", get_site_config().zones, key="trend_zones")
+
+    trend = load_trend(get_audit_store(), period, periods, zones=zones)
+    if trend.empty:
+        st.write("No audits in this period.")
+    else:
+        st.altair_chart(trend_chart(trend, period), use_container_width=True)
+
+
+@profiled()
+def export_page_data(audit_id):
+    """
+    Let the user pick columns, format and dates, then stream the export.
+    """
+    from export import DEFAULT_EXPORT_COLUMNS, EXPORT_FORMATS, export_audits
+
+    with st.expander("Download data"):
+        columns = st.multiselect("Columns:", EXPORT_COLUMNS, default=DEFAULT_EXPORT_COLUMNS)
+        export_format = st.radio("Format:", list(EXPORT_FORMATS), horizontal=True)
+        date_range = st.date_input("Conducted between:", value=(), key="export_dates")
+        start, end = (list(date_range) + [None, None])[:2]
+
+        if not columns:
+            st.info("Select at least one column to export.")
+        elif st.button(f"Prepare {export_format}"):
+            extension, mime = EXPORT_FORMATS[export_format]
+            data = export_audits(get_audit_store(), columns, export_format, audit_id=audit_id, start=start, end=end)
+            st.download_button(f"Download {export_format}", data, file_name=f"audit_data.{extension}", mime=mime)
+
+
+
+@profiled()
+def search_findings():
+    """
+    Full-text search over every saved comment and failed check.
+    """
+    import time
+
+    store = get_audit_store()
+    with st.expander("Search past findings"):
+        text = st.text_input("Search for:", placeholder="e.g. pest, ice buildup")
+        zone = st.selectbox("Zone:", ["All zones", *get_site_config().zones], key="search_zone")
+        auditors = {"All auditors": None}
+        auditors.update({name.title(): name for name in store.auditors()})
+        auditor = auditors[st.selectbox("Auditor:", list(auditors), key="search_auditor")]
+        date_range = st.date_input("Conducted between:", value=(), key="search_dates")
+        start, end = (list(date_range) + [None, None])[:2]
+        if not text.strip():
+            return
+
+        started = time.perf_counter()
+        results = store.search(
+            text,
+            auditor=auditor,
+            zone=None if zone == "All zones" else zone,
+            start=start, end=end,
+        )
+        elapsed = 1000 * (time.perf_counter() - started)
+        st.caption(f"{len(results)} result(s) in {elapsed:.0f} ms")
+        for row in results:
+            st.markdown(f"**{row['zone']}** · {row['kind']} · {row['auditor'].title()} · {row['day']} (audit #{row['audit_id']})")
+            st.markdown(row['snippet'])
+
+
+ACTION_VIEWS = ["Overdue in my zones", "Open in my zones", "Assigned to me", "All open"]
+
+# Zone of corrective actions raised from the sign-out comment
+SIGN_OUT_ZONE = "General"
+
+
+@profiled()
+def corrective_actions():
+    """
+    List open corrective actions and let auditors assign, reschedule, progress
+    and verify them. Every view is one index read on zone, owner or due date.
+    """
+    store = get_audit_store()
+    auditor = st.session_state['auditor_name']
+    with st.expander("Corrective actions", expanded=True):
+        view = st.radio("Actions:", ACTION_VIEWS, horizontal=True, key="action_view")
+        site = get_auditor_site()
+        filters = {
+            "Overdue in my zones": {'zones': get_assigned_food_production_zones(auditor), 'due_before': date.today(), 'site': site},
+            "Open in my zones": {'zones': get_assigned_food_production_zones(auditor), 'site': site},
+            "Assigned to me": {'owner': auditor},
+            "All open": {},
+        }[view]
+        actions = store.open_actions(**filters)
+        if not actions:
+            st.write("No corrective actions here.")
+            return
+
+        today = date.today().isoformat()
+        st.dataframe(
+            [
+                {
+                    'Action': f"#{action['id']}",
+                    'Zone': action['zone'],
+                    'Finding': action['description'],
+                    'Owner': (action['owner'] or '-').title(),
+                    'Due': action['due_on'],
+                    'Status': action['status'],
+                    'Overdue': action['due_on'] < today,
+                }
+                for action in actions
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
+        total = store.open_action_count(**filters)
+        if total > len(actions):
+            st.caption(f"Showing the {len(actions)} due soonest of {total}.")
+
+        labels = {f"#{action['id']} {action['zone']}: {action['description'][:60]}": action for action in actions}
+        choice = st.selectbox("Update action:", ["Choose an action", *labels], key="action_choice")
+        if choice == "Choose an action":
+            return
+        action = labels[choice]
+        with st.form(f"action_{action['id']}"):
+            owner = st.text_input("Owner:", value=(action['owner'] or '').title())
+            due_on = st.date_input("Due on:", value=date.fromisoformat(action['due_on']))
+            status = st.selectbox("Status:", ACTION_STATUSES, index=ACTION_STATUSES.index(action['status']))
+            photo = st.file_uploader("Verification photo:", help="Needed before the action can be marked Verified.")
+            if not st.form_submit_button("Save action"):
+                return
+        digest = None
+        if photo is not None:
+            digest = store_photos(action['zone'], [photo])[0]['Photo']
+        try:
+            store.update_action(
+                action['id'], auditor, owner=owner.strip().lower(), due_on=due_on, status=status, verification_photo=digest,
+            )
+        except ActionError as exc:
+            st.error(str(exc))
+            return
+        st.toast(f"Action #{action['id']} saved.")
+        st.rerun()
+
 
 def comments_sign_out_page():
     st.title("Comments and Sign-out Page")
-    if 'audit_data' in st.session_state:
-        audit_data = st.session_state['audit_data']
-        comments = [row.get('Comments', '') for row in audit_data if 'Comments' in row]
+    search_findings()
+    if 'auditor_name' in st.session_state:
+        corrective_actions()
+    if 'audit_id' in st.session_state:
+        comments = [row['comment'] for row in get_audit_store().comments(st.session_state['audit_id'])]
 
         if comments:
             st.write("Comments:")
             for comment in comments:
                 st.write(comment)
-            # Create a Word document to save comments
-            document = Document()
-            document.add_heading('Audit Comments', level=1)
-            for comment in comments:
-                document.add_paragraph(comment)
-            st.markdown(get_word_download_link(document), unsafe_allow_html=True)
         else:
             st.write("No comments found.")
+
+        audit_report_download(st.session_state['audit_id'])
         
         # Text input for adding new comments
         new_comment = st.text_area("Add a new comment:")
         
         signature = st.text_input("Enter your signature:")
         if st.button("Sign Out"):
-            del st.session_state['audit_data']
+            # Results stay in the audit store, the next submit starts a new audit.
+            # A closing comment becomes a corrective action so it is not lost.
+            if new_comment.strip():
+                get_audit_store().add_action(
+                    SIGN_OUT_ZONE, new_comment.strip(), owner=st.session_state.get('auditor_name'),
+                    audit_id=st.session_state['audit_id'], created_by=st.session_state.get('auditor_name'),
+                )
+            forget_audit()
             st.success("Signed out successfully!")
 
 
-def get_word_download_link(document):
+@st.cache_resource
+def get_report_renderer():
+    from reports import ReportRenderer
+
+    return ReportRenderer(get_audit_store(), get_photo_store(), differ=get_audit_differ())
+
+
+@profiled()
+def audit_report_download(audit_id):
     """
-    Generate a download link for the Word document.
+    Build the Word report on a worker thread when asked, then offer it for download.
     """
-    tmp_download_link = None
-    with NamedTemporaryFile(delete=False, suffix='.docx') as tmp_file:
-        document.save(tmp_file.name)
-        tmp_download_link = f'<a href="data:application/vnd.openxmlformats-officedocument.wordprocessingml.document;base64,{base64.b64encode(open(tmp_file.name, "rb").read()).decode()}">Download Comments as Word Document</a>'
-    return tmp_download_link
+    from reports import DOCX_MIME
+
+    renderer = get_report_renderer()
+    future = renderer.get(audit_id)
+
+    if future is None:
+        if st.button("Prepare audit report"):
+            future = renderer.request(audit_id)
+        else:
+            return
+
+    if not future.done():
+        st.info("The audit report is being prepared.")
+        st.button("Check again")
+    elif future.exception() is not None:
+        st.error(f"The audit report could not be created: {future.exception()}")
+        if st.button("Try again"):
+            renderer.request(audit_id)
+    else:
+        st.download_button("Download Audit Report as Word Document", future.result(), file_name="audit_report.docx", mime=DOCX_MIME)
 
 
 # Main app
@@ -662,8 +1115,70 @@ def main():
 
     st.sidebar.title("ACL Food Safety Auditor")
     selection = st.sidebar.radio("Go to", list(pages.keys()))
+    open_alert_count = get_audit_store().open_alert_count()
+    if open_alert_count:
+        st.sidebar.error(f"{open_alert_count} open alert(s), see the Analysis page.")
+    if 'auditor_name' in st.session_state:
+        overdue = get_audit_store().open_action_count(
+            zones=get_assigned_food_production_zones(st.session_state['auditor_name']), due_before=date.today(),
+            site=get_auditor_site(),
+        )
+        if overdue:
+            st.sidebar.warning(f"{overdue} overdue corrective action(s) in your zones.")
+
+    profiler = get_profiler()
+    if profiler is None:
+        pages[selection]()
+        enforce_session_budget()
+        return
+
+    with profiler.rerun(selection) as record:
+        pages[selection]()
+        with stage("enforce_session_budget"):
+            record['session_bytes'] = enforce_session_budget()
+    diagnostics_sidebar(profiler)
 
-    pages[selection]()
+
+def get_profiler():
+    """
+    The session's rerun profiler, or None unless diagnostics were switched on
+    with ACL_DIAGNOSTICS set to timers, alloc or profile. Only then may
+    ?diagnostics= pick another mode for one session, so visitors cannot turn
+    on tracing for the whole worker.
+    """
+    mode = os.environ.get("ACL_DIAGNOSTICS")
+    if mode not in MODES:
+        return None
+    mode = st.query_params.get("diagnostics", mode)
+    if mode not in MODES:
+        return None
+    profiler = st.session_state.get('profiler')
+    if profiler is None or profiler.mode != mode:
+        profiler = RerunProfiler(mode, log_path=os.environ.get("ACL_DIAGNOSTICS_LOG"))
+        st.session_state['profiler'] = profiler
+    return profiler
+
+
+def diagnostics_sidebar(profiler):
+    with st.sidebar.expander("Diagnostics"):
+        latest = profiler.reruns[-1]
+        st.write(f"Rerun {latest['rerun']} ({latest['page']}): {latest['total_ms']:.1f} ms")
+        meter = get_session_meter()
+        st.metric("Session state", f"{latest['session_bytes'] / 1024:.0f} KiB")
+        st.metric(f"Worker session state ({meter.session_count()} sessions)", f"{meter.worker_bytes() / 1024:.0f} KiB")
+        if 'traced_peak_kb' in latest:
+            st.write(f"Peak traced memory: {latest['traced_peak_kb']:.0f} KiB")
+        st.dataframe(
+            [{'Stage': '  ' * entry['depth'] + entry['stage'], 'ms': entry['ms'], 'KiB': entry.get('alloc_kb')} for entry in latest['stages']],
+            hide_index=True,
+        )
+        st.dataframe(
+            [{'Rerun': record['rerun'], 'Page': record['page'], 'ms': record['total_ms']} for record in reversed(profiler.reruns)],
+            hide_index=True,
+        )
+        if 'profile' in latest:
+            st.code(latest['profile'], language=None)
+        st.download_button("Download JSON lines", profiler.to_jsonl(), file_name="diagnostics.jsonl", mime="application/x-ndjson")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,114 @@
+import os
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from photo_store import DEFAULT_DATA_DIR
+from scoring import EMPTY_SCORE, Score, combine, score_answers
+
+DEFAULT_ARCHIVE_DIR = os.path.join(DEFAULT_DATA_DIR, "archive")
+
+# Repeated strings are dictionary encoded, so each zone, question and answer
+# is stored once per column chunk and reads back as a pandas categorical
+LABEL = pa.dictionary(pa.int32(), pa.string())
+
+# Column order matches the ARCHIVE_QUERIES in audit_store
+ARCHIVE_SCHEMAS = {
+    'responses': pa.schema([
+        ('day', pa.string()), ('zone', pa.string()), ('audit_id', pa.int64()),
+        ('auditor', LABEL), ('client_site', LABEL), ('section', LABEL),
+        ('question_id', LABEL), ('question', LABEL), ('answer', LABEL), ('updated_at', pa.string()),
+    ]),
+    'comments': pa.schema([
+        ('day', pa.string()), ('zone', pa.string()), ('audit_id', pa.int64()),
+        ('auditor', LABEL), ('comment', pa.string()), ('updated_at', pa.string()),
+    ]),
+    'photos': pa.schema([
+        ('day', pa.string()), ('zone', pa.string()), ('audit_id', pa.int64()),
+        ('auditor', LABEL), ('digest', pa.string()), ('filename', pa.string()),
+        ('size', pa.int64()), ('mime_type', LABEL), ('width', pa.int32()), ('height', pa.int32()),
+        ('created_at', pa.string()),
+    ]),
+}
+
+# Hive style directories, e.g. responses/day=2024-05-01/zone=Cold%20Room/
+PARTITIONING = ds.partitioning(pa.schema([('day', pa.string()), ('zone', pa.string())]), flavor="hive")
+
+
+def _batches(chunks, schema):
+    for rows in chunks:
+        columns = zip(*rows)
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+
+def write_archive(store, root=DEFAULT_ARCHIVE_DIR, start=None, end=None, chunk_size=50000):
+    """
+    Write the store's responses, comments and photos to Parquet datasets
+    partitioned by day and zone.
+
+    Archiving a date range replaces the partitions it touches and leaves all
+    other days alone, so a nightly job only has to archive the last day.
+    """
+    for table, schema in ARCHIVE_SCHEMAS.items():
+        ds.write_dataset(
+            _batches(store.iter_archive(table, chunk_size=chunk_size, start=start, end=end), schema),
+            os.path.join(root, table),
+            schema=schema,
+            format="parquet",
+            partitioning=PARTITIONING,
+            existing_data_behavior="delete_matching",
+            basename_template=f"{table}-{{i}}.parquet",
+            file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+        )
+
+
+def read_archive(table, root=DEFAULT_ARCHIVE_DIR, columns=None, start=None, end=None, zones=None, auditor=None):
+    """
+    Read an archived table as an Arrow table.
+
+    Day and zone filters only open the matching partitions, and the auditor
+    filter is pushed down to the Parquet row groups, so only the requested
+    columns of the relevant files are ever read.
+    """
+    path = os.path.join(root, table)
+    if not os.path.isdir(path):
+        return ARCHIVE_SCHEMAS[table].empty_table().select(columns or ARCHIVE_SCHEMAS[table].names)
+
+    dataset = ds.dataset(path, schema=ARCHIVE_SCHEMAS[table], format="parquet", partitioning=PARTITIONING)
+    condition = None
+    for clause in (
+        ds.field('day') >= start.isoformat() if start is not None else None,
+        ds.field('day') <= end.isoformat() if end is not None else None,
+        ds.field('zone').isin(list(zones)) if zones else None,
+        ds.field('auditor') == auditor if auditor is not None else None,
+    ):
+        if clause is not None:
+            condition = clause if condition is None else condition & clause
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def archive_zone_scores(root=DEFAULT_ARCHIVE_DIR, start=None, end=None, zones=None, auditor=None):
+    """
+    Audit counts and summed scores per zone, computed from the archive alone.
+
+    Answers are counted per distinct question and answer first, so scoring
+    runs once per group rather than once per stored answer.
+    """
+    table = read_archive(
+        'responses', root, columns=['zone', 'audit_id', 'question_id', 'question', 'answer'],
+        start=start, end=end, zones=zones, auditor=auditor,
+    )
+    audits = {
+        row['zone']: row['audit_id_count_distinct']
+        for row in table.group_by('zone').aggregate([('audit_id', 'count_distinct')]).to_pylist()
+    }
+    scores = {}
+    groups = table.group_by(['zone', 'question_id', 'question', 'answer']).aggregate([('audit_id', 'count')])
+    for row in groups.to_pylist():
+        score = score_answers([(row['question_id'], row['question'], row['answer'])])
+        count = row['audit_id_count']
+        scores[row['zone']] = combine(scores.get(row['zone'], EMPTY_SCORE), Score(*(value * count for value in score)))
+    return {zone: (audits[zone], score) for zone, score in sorted(scores.items())}
@@ -0,0 +1,1251 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+from photo_store import DEFAULT_DATA_DIR
+from scoring import CRITICAL_WEIGHT, EMPTY_SCORE, Score, combine, question_weight, score_answers
+from trends import audit_day, rollup_keys
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audits (
+    id INTEGER PRIMARY KEY,
+    auditor TEXT NOT NULL,
+    client_site TEXT,
+    location TEXT,
+    position TEXT,
+    conducted_on TEXT,
+    revision INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    site TEXT
+);
+CREATE TABLE IF NOT EXISTS responses (
+    audit_id INTEGER NOT NULL REFERENCES audits(id) ON DELETE CASCADE,
+    zone TEXT NOT NULL,
+    section TEXT NOT NULL,
+    question TEXT NOT NULL,
+    question_id TEXT,
+    answer TEXT,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (audit_id, zone, question)
+);
+CREATE TABLE IF NOT EXISTS comments (
+    audit_id INTEGER NOT NULL REFERENCES audits(id) ON DELETE CASCADE,
+    zone TEXT NOT NULL,
+    comment TEXT NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (audit_id, zone)
+);
+CREATE TABLE IF NOT EXISTS photos (
+    audit_id INTEGER NOT NULL REFERENCES audits(id) ON DELETE CASCADE,
+    zone TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    filename TEXT,
+    size INTEGER,
+    mime_type TEXT,
+    width INTEGER,
+    height INTEGER,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (audit_id, zone, digest)
+);
+CREATE TABLE IF NOT EXISTS zone_scores (
+    audit_id INTEGER NOT NULL REFERENCES audits(id) ON DELETE CASCADE,
+    zone TEXT NOT NULL,
+    earned REAL NOT NULL,
+    possible REAL NOT NULL,
+    answered INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    critical_failed INTEGER NOT NULL,
+    PRIMARY KEY (audit_id, zone)
+);
+CREATE TABLE IF NOT EXISTS audit_scores (
+    audit_id INTEGER PRIMARY KEY REFERENCES audits(id) ON DELETE CASCADE,
+    earned REAL NOT NULL,
+    possible REAL NOT NULL,
+    answered INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    critical_failed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    period TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    auditor TEXT NOT NULL,
+    earned REAL NOT NULL,
+    possible REAL NOT NULL,
+    answered INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    critical_failed INTEGER NOT NULL,
+    PRIMARY KEY (period, zone, auditor)
+);
+CREATE TABLE IF NOT EXISTS weekly_rollups (
+    period TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    auditor TEXT NOT NULL,
+    earned REAL NOT NULL,
+    possible REAL NOT NULL,
+    answered INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    critical_failed INTEGER NOT NULL,
+    PRIMARY KEY (period, zone, auditor)
+);
+CREATE TABLE IF NOT EXISTS zone_commits (
+    audit_id INTEGER NOT NULL REFERENCES audits(id) ON DELETE CASCADE,
+    zone TEXT NOT NULL,
+    auditor TEXT,
+    version INTEGER NOT NULL,
+    committed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (audit_id, zone)
+);
+CREATE TABLE IF NOT EXISTS sync_batches (
+    batch_id TEXT PRIMARY KEY,
+    audit_id INTEGER,
+    auditor TEXT,
+    entries INTEGER NOT NULL,
+    received_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    audit_id INTEGER NOT NULL REFERENCES audits(id) ON DELETE CASCADE,
+    zone TEXT NOT NULL,
+    question_id TEXT,
+    rule TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    message TEXT NOT NULL,
+    auditor TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    acknowledged_at TEXT,
+    acknowledged_by TEXT,
+    UNIQUE (audit_id, zone, question_id, rule)
+);
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY,
+    audit_id INTEGER REFERENCES audits(id) ON DELETE SET NULL,
+    zone TEXT NOT NULL,
+    item_key TEXT,
+    source TEXT NOT NULL,
+    description TEXT NOT NULL,
+    owner TEXT,
+    due_on TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'Open',
+    verification_photo TEXT,
+    created_by TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT,
+    updated_by TEXT,
+    closed_at TEXT,
+    UNIQUE (audit_id, zone, item_key)
+);
+CREATE TABLE IF NOT EXISTS store_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO store_version (id, version) VALUES (1, 0);
+CREATE INDEX IF NOT EXISTS idx_audits_auditor ON audits (auditor);
+CREATE INDEX IF NOT EXISTS idx_audits_conducted_on ON audits (conducted_on);
+CREATE INDEX IF NOT EXISTS idx_audits_created_at ON audits (created_at);
+CREATE INDEX IF NOT EXISTS idx_audits_day ON audits (COALESCE(conducted_on, date(created_at)), id);
+CREATE INDEX IF NOT EXISTS idx_audits_site_day ON audits (site, COALESCE(conducted_on, date(created_at)), id);
+CREATE INDEX IF NOT EXISTS idx_responses_zone ON responses (zone);
+CREATE INDEX IF NOT EXISTS idx_responses_question_id ON responses (question_id);
+CREATE INDEX IF NOT EXISTS idx_alerts_open ON alerts (acknowledged_at, created_at);
+CREATE INDEX IF NOT EXISTS idx_actions_open_zone ON actions (zone, due_on) WHERE closed_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_actions_open_owner ON actions (owner, due_on) WHERE closed_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_actions_open_due ON actions (due_on) WHERE closed_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_comments_zone ON comments (zone);
+CREATE INDEX IF NOT EXISTS idx_photos_zone ON photos (zone);
+CREATE INDEX IF NOT EXISTS idx_zone_scores_zone ON zone_scores (zone);
+CREATE INDEX IF NOT EXISTS idx_daily_rollups_zone ON daily_rollups (zone, period);
+CREATE INDEX IF NOT EXISTS idx_weekly_rollups_zone ON weekly_rollups (zone, period);
+CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5 (
+    comment, content='comments', content_rowid='rowid', tokenize='porter unicode61'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS findings_fts USING fts5 (
+    question, content='responses', content_rowid='rowid', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS comments_fts_insert AFTER INSERT ON comments BEGIN
+    INSERT INTO comments_fts (rowid, comment) VALUES (new.rowid, new.comment);
+END;
+CREATE TRIGGER IF NOT EXISTS comments_fts_delete AFTER DELETE ON comments BEGIN
+    INSERT INTO comments_fts (comments_fts, rowid, comment) VALUES ('delete', old.rowid, old.comment);
+END;
+CREATE TRIGGER IF NOT EXISTS findings_fts_insert AFTER INSERT ON responses WHEN new.answer = 'No' BEGIN
+    INSERT INTO findings_fts (rowid, question) VALUES (new.rowid, new.question);
+END;
+CREATE TRIGGER IF NOT EXISTS findings_fts_delete AFTER DELETE ON responses WHEN old.answer = 'No' BEGIN
+    INSERT INTO findings_fts (findings_fts, rowid, question) VALUES ('delete', old.rowid, old.question);
+END;
+CREATE TRIGGER IF NOT EXISTS findings_fts_update_old AFTER UPDATE ON responses WHEN old.answer = 'No' BEGIN
+    INSERT INTO findings_fts (findings_fts, rowid, question) VALUES ('delete', old.rowid, old.question);
+END;
+CREATE TRIGGER IF NOT EXISTS findings_fts_update_new AFTER UPDATE ON responses WHEN new.answer = 'No' BEGIN
+    INSERT INTO findings_fts (rowid, question) VALUES (new.rowid, new.question);
+END;
+"""
+
+# Bump when a new derived table has to be rebuilt from existing responses
+DERIVED_VERSION = 3
+
+SCORE_COLUMNS = "earned, possible, answered, failed, critical_failed"
+
+# The day an audit counts towards in SQL, the same rule as trends.audit_day.
+# idx_audits_day and idx_audits_site_day are built on this expression, so
+# keep them in step.
+AUDIT_DAY = "COALESCE(a.conducted_on, date(a.created_at))"
+
+# Corrective actions move through these states. Only Verified closes an
+# action, and it needs a verification photo.
+ACTION_STATUSES = ("Open", "In progress", "Done", "Verified")
+
+# Days from the audit day until a corrective action is due, by source
+ACTION_DUE_DAYS = {'critical': 1, 'check': 7, 'comment': 14}
+
+# Columns added after the first release, as (table, column, definition)
+MIGRATIONS = (
+    ('responses', 'question_id', 'TEXT'),
+    ('audits', 'revision', 'INTEGER NOT NULL DEFAULT 0'),
+    ('audits', 'site', 'TEXT'),
+)
+
+# Columns of the flat frame the Analysis page has always worked with, one
+# query per kind of row. Every part names its columns, so any of them can
+# come first in a UNION.
+FRAME_PARTS = {
+    'Answers': """
+        SELECT x.zone AS "Location",
+               CASE WHEN x.section = 'Location' THEN x.question END AS "Question",
+               CASE WHEN x.section = 'Food Production Zone' THEN x.question END AS "Food Production Zone",
+               x.answer AS "Answer", NULL AS "Comments", NULL AS "Photo"
+        FROM responses x JOIN audits a ON a.id = x.audit_id
+        WHERE {where}
+    """,
+    'Comments': """
+        SELECT x.zone AS "Location", NULL AS "Question", NULL AS "Food Production Zone",
+               NULL AS "Answer", x.comment AS "Comments", NULL AS "Photo"
+        FROM comments x JOIN audits a ON a.id = x.audit_id
+        WHERE {where}
+    """,
+    'Photos': """
+        SELECT x.zone AS "Location", NULL AS "Question", NULL AS "Food Production Zone",
+               NULL AS "Answer", NULL AS "Comments", x.digest AS "Photo"
+        FROM photos x JOIN audits a ON a.id = x.audit_id
+        WHERE {where}
+    """,
+}
+FRAME_QUERY = " UNION ALL ".join(FRAME_PARTS.values())
+
+# Columns the paged audit grid can be sorted by
+FRAME_SORT_COLUMNS = ('Location', 'Question', 'Food Production Zone', 'Answer')
+
+# Answer counts per zone and question, the basis of every chart
+TALLY_QUERY = """
+SELECT x.zone AS "Location", x.section AS "Section", x.question AS "Question",
+       x.answer AS "Answer", COUNT(*) AS "Count"
+FROM responses x JOIN audits a ON a.id = x.audit_id
+WHERE {where}
+GROUP BY x.zone, x.section, x.question, x.answer
+"""
+
+# Comments and failed checks ("No" answers) matching a full-text query. The
+# indexes are kept in step with their tables by the triggers in SCHEMA.
+SEARCH_QUERY = """
+SELECT * FROM (
+    SELECT 'Comment' AS kind, x.audit_id, x.zone, x.comment AS text,
+           snippet(comments_fts, 0, '**', '**', '...', 16) AS snippet,
+           a.auditor, COALESCE(a.conducted_on, date(a.created_at)) AS day, bm25(comments_fts) AS rank
+    FROM comments_fts JOIN comments x ON x.rowid = comments_fts.rowid JOIN audits a ON a.id = x.audit_id
+    WHERE comments_fts MATCH ? AND {where}
+    UNION ALL
+    SELECT 'Failed check', x.audit_id, x.zone, x.question,
+           snippet(findings_fts, 0, '**', '**', '...', 16),
+           a.auditor, COALESCE(a.conducted_on, date(a.created_at)), bm25(findings_fts)
+    FROM findings_fts JOIN responses x ON x.rowid = findings_fts.rowid JOIN audits a ON a.id = x.audit_id
+    WHERE findings_fts MATCH ? AND {where}
+)
+ORDER BY rank, day DESC
+LIMIT ?
+"""
+
+# Normalised rows for the Parquet archive, one query per archived table.
+# Every query starts with the day and zone the archive is partitioned by.
+ARCHIVE_QUERIES = {
+    'responses': f"""
+        SELECT {AUDIT_DAY}, x.zone, x.audit_id, a.auditor, a.client_site,
+               x.section, x.question_id, x.question, x.answer, x.updated_at
+        FROM responses x JOIN audits a ON a.id = x.audit_id
+    """,
+    'comments': f"""
+        SELECT {AUDIT_DAY}, x.zone, x.audit_id, a.auditor, x.comment, x.updated_at
+        FROM comments x JOIN audits a ON a.id = x.audit_id
+    """,
+    'photos': f"""
+        SELECT {AUDIT_DAY}, x.zone, x.audit_id, a.auditor, x.digest, x.filename,
+               x.size, x.mime_type, x.width, x.height, x.created_at
+        FROM photos x JOIN audits a ON a.id = x.audit_id
+    """,
+}
+
+# Columns offered by the export, and the SQL behind each one per detail table
+EXPORT_COLUMNS = (
+    'Audit ID', 'Auditor', 'Site', 'Client / Site', 'Conducted On', 'Location',
+    'Question ID', 'Question', 'Answer', 'Comments', 'Photo',
+)
+EXPORT_EXPRESSIONS = {
+    'Audit ID': 'a.id',
+    'Auditor': 'a.auditor',
+    'Site': 'a.site',
+    'Client / Site': 'a.client_site',
+    'Conducted On': 'a.conducted_on',
+    'Location': 'x.zone',
+}
+EXPORT_DETAILS = {
+    'responses': {'Question ID': 'x.question_id', 'Question': 'x.question', 'Answer': 'x.answer'},
+    'comments': {'Comments': 'x.comment'},
+    'photos': {'Photo': 'x.digest'},
+}
+
+
+class ZoneConflict(Exception):
+    """
+    Raised when a zone was committed by someone else since the writer last
+    read it.
+    """
+
+    def __init__(self, zone, auditor, version, committed_at):
+        super().__init__(f"{zone} was changed by {auditor} at {committed_at}")
+        self.zone = zone
+        self.auditor = auditor
+        self.version = version
+        self.committed_at = committed_at
+
+
+class MissingAudit(LookupError):
+    """
+    Raised when writing to an audit that was deleted, e.g. by its owner
+    while a contributor still had it open.
+    """
+
+    def __init__(self, audit_id):
+        super().__init__(f"Audit #{audit_id} no longer exists")
+        self.audit_id = audit_id
+
+
+class ActionError(ValueError):
+    pass
+
+
+class AuditStore:
+    """
+    Persistent audit repository backed by SQLite in WAL mode.
+
+    Each thread gets its own connection. WAL lets readers carry on while an
+    auditor is writing, and writes are short transactions so concurrent
+    submits only wait on each other briefly.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DEFAULT_DATA_DIR, "audits.db")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._migrate()
+        self.connection().executescript(SCHEMA)
+        self._backfill_scores()
+
+    def _migrate(self):
+        # Add columns introduced after a database was first created
+        conn = self.connection()
+        for table, column, definition in MIGRATIONS:
+            columns = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if columns and column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _backfill_scores(self):
+        # Databases created before scores or rollups existed need their
+        # derived tables built once from the stored responses
+        conn = self.connection()
+        if conn.execute("PRAGMA user_version").fetchone()[0] < DERIVED_VERSION:
+            self.rebuild_scores()
+            self.rebuild_search()
+            conn.execute(f"PRAGMA user_version = {DERIVED_VERSION}")
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self.connection())
+
+    def version(self):
+        """
+        Counter bumped by every write, used as a cache key for derived data.
+        """
+        return self.connection().execute("SELECT version FROM store_version WHERE id = 1").fetchone()[0]
+
+    def create_audit(self, auditor, client_site=None, location=None, position=None, conducted_on=None, site=None):
+        """
+        Start an audit. site is the configured site whose zones it covers,
+        zone names are only unique within a site.
+        """
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO audits (auditor, client_site, location, position, conducted_on, site) VALUES (?, ?, ?, ?, ?, ?)",
+                (auditor, client_site, location, position, _date(conducted_on), site),
+            )
+            return cursor.lastrowid
+
+    def update_audit(self, audit_id, client_site=None, location=None, position=None, conducted_on=None):
+        with self.transaction() as conn:
+            previous = self._audit_row(conn, audit_id)
+            conn.execute(
+                """
+                UPDATE audits SET client_site = ?, location = ?, position = ?, conducted_on = ?,
+                                  revision = revision + 1
+                WHERE id = ?
+                """,
+                (client_site, location, position, _date(conducted_on), audit_id),
+            )
+            current = self._audit_row(conn, audit_id)
+            if previous and _audit_day(previous) != _audit_day(current):
+                # Move the audit's totals over to its new day and week
+                for zone, score in self._zone_score_rows(conn, audit_id):
+                    auditor = self._zone_auditor(conn, audit_id, zone, current)
+                    self._apply_rollups(conn, previous, zone, score, -1, auditor)
+                    self._apply_rollups(conn, current, zone, score, 1, auditor)
+
+    def get_audit(self, audit_id):
+        row = self.connection().execute("SELECT * FROM audits WHERE id = ?", (audit_id,)).fetchone()
+        return dict(row) if row else None
+
+    def auditors(self):
+        return [row['auditor'] for row in self.connection().execute("SELECT DISTINCT auditor FROM audits ORDER BY auditor")]
+
+    def revision(self, audit_id):
+        """
+        Counter bumped by every change to one audit.
+        """
+        row = self.connection().execute("SELECT revision FROM audits WHERE id = ?", (audit_id,)).fetchone()
+        return row['revision'] if row else None
+
+    def open_audits(self, since, limit=100):
+        """
+        Audits whose audit day is on or after a day, newest first, for
+        auditors joining a colleague's audit.
+
+        Imported history keeps its own day, so it is not listed just because
+        it was loaded recently. Reads idx_audits_day backwards.
+        """
+        return self.connection().execute(
+            f"""
+            SELECT a.id, a.auditor, a.client_site, a.location, a.conducted_on, a.created_at FROM audits a
+            WHERE {AUDIT_DAY} >= ?
+            ORDER BY {AUDIT_DAY} DESC, a.id DESC LIMIT ?
+            """,
+            (_date(since), limit),
+        ).fetchall()
+
+    def zone_version(self, audit_id, zone):
+        row = self.connection().execute(
+            "SELECT version FROM zone_commits WHERE audit_id = ? AND zone = ?", (audit_id, zone)
+        ).fetchone()
+        return row['version'] if row else 0
+
+    def zone_commits(self, audit_id):
+        """
+        Who last committed each zone of an audit, with the zone's score.
+        """
+        return self.connection().execute(
+            f"""
+            SELECT c.zone, c.auditor, c.version, c.committed_at, {SCORE_COLUMNS}
+            FROM zone_commits c LEFT JOIN zone_scores s ON s.audit_id = c.audit_id AND s.zone = c.zone
+            WHERE c.audit_id = ? ORDER BY c.zone
+            """,
+            (audit_id,),
+        ).fetchall()
+
+    def _commit_zone(self, conn, audit_id, zone, auditor, expected_version):
+        # Zones are versioned separately, so auditors sharing an audit only
+        # conflict when they write the same zone
+        audit = self._audit_row(conn, audit_id)
+        if audit is None:
+            raise MissingAudit(audit_id)
+        row = conn.execute(
+            "SELECT auditor, version, committed_at FROM zone_commits WHERE audit_id = ? AND zone = ?",
+            (audit_id, zone),
+        ).fetchone()
+        version = row['version'] if row else 0
+        if expected_version is not None and version != expected_version:
+            raise ZoneConflict(zone, row['auditor'], version, row['committed_at'])
+        previous = (row['auditor'] if row else None) or audit['auditor']
+        if row and previous != (auditor or audit['auditor']):
+            # The zone's totals follow it to the auditor committing it now
+            score = self._score(conn, "zone_scores", "audit_id = ? AND zone = ?", (audit_id, zone))
+            self._apply_rollups(conn, audit, zone, score, -1, previous)
+            self._apply_rollups(conn, audit, zone, score, 1, auditor or audit['auditor'])
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO zone_commits (audit_id, zone, auditor, version)
+            VALUES (?, ?, ?, ?)
+            """,
+            (audit_id, zone, auditor, version + 1),
+        )
+        return version + 1
+
+    def save_zone(self, audit_id, zone, rows, auditor=None, expected_version=None):
+        """
+        Upsert the rows collected for one location/zone in a single transaction.
+
+        Submitting the same zone again overwrites the previous answers instead
+        of adding duplicates. With expected_version, ZoneConflict is raised if
+        the zone was committed again since that version was read. Returns the
+        zone's new version.
+        """
+        with self.transaction() as conn:
+            version = self._write_zone(conn, audit_id, zone, rows, auditor, expected_version)
+            self._sync_actions(conn, audit_id, zone, auditor)
+            return version
+
+    def apply_batch(self, batch_id, audit_id, auditor, zones):
+        """
+        Save a batch of queued offline answers, {zone: rows}, exactly once.
+
+        Returns False when the batch id was applied before, which happens when
+        a client resends a batch whose acknowledgement it never received.
+        """
+        conn = self.connection()
+        if conn.execute("SELECT 1 FROM sync_batches WHERE batch_id = ?", (batch_id,)).fetchone():
+            return False
+        with self.transaction() as conn:
+            # Checked again under the write lock in case two sessions race
+            if conn.execute("SELECT 1 FROM sync_batches WHERE batch_id = ?", (batch_id,)).fetchone():
+                return False
+            for zone, rows in zones.items():
+                self._write_zone(conn, audit_id, zone, rows, auditor, None)
+                self._sync_actions(conn, audit_id, zone, auditor)
+            conn.execute(
+                "INSERT INTO sync_batches (batch_id, audit_id, auditor, entries) VALUES (?, ?, ?, ?)",
+                (batch_id, audit_id, auditor, sum(len(rows) for rows in zones.values())),
+            )
+        return True
+
+    def import_audit(self, batch_id, auditor, zones, client_site=None, conducted_on=None, site=None):
+        """
+        Create an audit from imported rows, {zone: rows}, unless rows with the
+        same batch id were imported before. Returns the new audit id, or None
+        for a duplicate.
+        """
+        if self.connection().execute("SELECT 1 FROM sync_batches WHERE batch_id = ?", (batch_id,)).fetchone():
+            return None
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM sync_batches WHERE batch_id = ?", (batch_id,)).fetchone():
+                return None
+            audit_id = conn.execute(
+                "INSERT INTO audits (auditor, client_site, conducted_on, site) VALUES (?, ?, ?, ?)",
+                (auditor, client_site, _date(conducted_on), site),
+            ).lastrowid
+            for zone, rows in zones.items():
+                self._write_zone(conn, audit_id, zone, rows, auditor, None)
+            conn.execute(
+                "INSERT INTO sync_batches (batch_id, audit_id, auditor, entries) VALUES (?, ?, ?, ?)",
+                (batch_id, audit_id, auditor, sum(len(rows) for rows in zones.values())),
+            )
+        return audit_id
+
+    def _write_zone(self, conn, audit_id, zone, rows, auditor, expected_version):
+        # A zone's comment is only replaced when the rows carry a Comments
+        # entry, which the zone forms always do and offline batches only do
+        # when the comment was edited
+        responses = []
+        comments = []
+        photos = []
+        replace_comments = False
+        for row in rows:
+            if 'Answer' in row:
+                section = 'Location' if 'Question' in row else 'Food Production Zone'
+                question = row.get('Question') or row.get('Food Production Zone')
+                responses.append((audit_id, zone, section, question, row.get('Question ID'), row['Answer']))
+            elif 'Comments' in row:
+                replace_comments = True
+                if row['Comments']:
+                    comments.append((audit_id, zone, row['Comments']))
+            elif row.get('Photo'):
+                photos.append((
+                    audit_id, zone, row['Photo'], row.get('Filename'), row.get('Size'),
+                    row.get('MIME Type'), row.get('Width'), row.get('Height'),
+                ))
+
+        version = self._commit_zone(conn, audit_id, zone, auditor, expected_version)
+        conn.executemany(
+            """
+            INSERT INTO responses (audit_id, zone, section, question, question_id, answer)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (audit_id, zone, question)
+            DO UPDATE SET question_id = excluded.question_id, answer = excluded.answer,
+                          updated_at = CURRENT_TIMESTAMP
+            """,
+            responses,
+        )
+        if replace_comments:
+            conn.execute("DELETE FROM comments WHERE audit_id = ? AND zone = ?", (audit_id, zone))
+            conn.executemany("INSERT INTO comments (audit_id, zone, comment) VALUES (?, ?, ?)", comments)
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO photos (audit_id, zone, digest, filename, size, mime_type, width, height)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            photos,
+        )
+        conn.execute("UPDATE audits SET revision = revision + 1 WHERE id = ?", (audit_id,))
+        self._rescore_zone(conn, audit_id, zone)
+        return version
+
+    def add_photos(self, audit_id, zone, photos):
+        """
+        Attach photo rows to a zone without touching its answers or comments.
+        """
+        with self.transaction() as conn:
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO photos (audit_id, zone, digest, filename, size, mime_type, width, height)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (audit_id, zone, row['Photo'], row.get('Filename'), row.get('Size'),
+                     row.get('MIME Type'), row.get('Width'), row.get('Height'))
+                    for row in photos
+                ],
+            )
+            conn.execute("UPDATE audits SET revision = revision + 1 WHERE id = ?", (audit_id,))
+
+    def clear_zone(self, audit_id, zone, auditor=None):
+        with self.transaction() as conn:
+            version = self._commit_zone(conn, audit_id, zone, auditor, None)
+            for table in ("responses", "comments", "photos"):
+                conn.execute(f"DELETE FROM {table} WHERE audit_id = ? AND zone = ?", (audit_id, zone))
+            conn.execute("UPDATE audits SET revision = revision + 1 WHERE id = ?", (audit_id,))
+            self._rescore_zone(conn, audit_id, zone)
+            self._sync_actions(conn, audit_id, zone, auditor)
+        return version
+
+    def _sync_actions(self, conn, audit_id, zone, auditor):
+        """
+        Keep one corrective action per failed check and per comment of a
+        submitted zone.
+
+        Resubmitting updates the wording of actions nobody has touched yet
+        and drops those whose check now passes. Actions someone has already
+        worked on are left alone. Imported history does not go through here.
+        """
+        day = _audit_day(self._audit_row(conn, audit_id))
+        items = []
+        for row in conn.execute(
+            "SELECT question_id, question FROM responses WHERE audit_id = ? AND zone = ? AND answer = 'No' ORDER BY rowid",
+            (audit_id, zone),
+        ):
+            critical = question_weight(row['question_id'], row['question']) >= CRITICAL_WEIGHT
+            due_on = day + timedelta(days=ACTION_DUE_DAYS['critical' if critical else 'check'])
+            items.append((row['question_id'] or row['question'], 'check', row['question'], due_on))
+        comment = conn.execute("SELECT comment FROM comments WHERE audit_id = ? AND zone = ?", (audit_id, zone)).fetchone()
+        if comment:
+            items.append(('comment', 'comment', comment['comment'], day + timedelta(days=ACTION_DUE_DAYS['comment'])))
+
+        conn.executemany(
+            """
+            INSERT INTO actions (audit_id, zone, item_key, source, description, owner, due_on, created_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (audit_id, zone, item_key) DO UPDATE SET description = excluded.description
+            WHERE updated_at IS NULL
+            """,
+            [(audit_id, zone, key, source, text, auditor, due_on.isoformat(), auditor) for key, source, text, due_on in items],
+        )
+        keys = [key for key, *_ in items]
+        conn.execute(
+            f"""
+            DELETE FROM actions WHERE audit_id = ? AND zone = ? AND updated_at IS NULL
+              AND item_key NOT IN ({', '.join('?' * len(keys))})
+            """,
+            (audit_id, zone, *keys),
+        )
+
+    def _rescore_zone(self, conn, audit_id, zone):
+        """
+        Rescore one zone and apply the difference to the audit's running total.
+
+        Only the zone's own responses are read, so the cost does not grow with
+        the number of audits stored.
+        """
+        previous = self._score(conn, "zone_scores", "audit_id = ? AND zone = ?", (audit_id, zone))
+        current = score_answers(conn.execute(
+            "SELECT question_id, question, answer FROM responses WHERE audit_id = ? AND zone = ?",
+            (audit_id, zone),
+        ))
+
+        if current.answered:
+            conn.execute(
+                f"""
+                INSERT OR REPLACE INTO zone_scores (audit_id, zone, {SCORE_COLUMNS})
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (audit_id, zone, *current),
+            )
+        else:
+            conn.execute("DELETE FROM zone_scores WHERE audit_id = ? AND zone = ?", (audit_id, zone))
+
+        delta = combine(current, previous, -1)
+        total = combine(self._score(conn, "audit_scores", "audit_id = ?", (audit_id,)), delta)
+        conn.execute(
+            f"INSERT OR REPLACE INTO audit_scores (audit_id, {SCORE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+            (audit_id, *total),
+        )
+        audit = self._audit_row(conn, audit_id)
+        self._apply_rollups(conn, audit, zone, delta, 1, self._zone_auditor(conn, audit_id, zone, audit))
+
+    def _zone_auditor(self, conn, audit_id, zone, audit):
+        # Rollups count a zone for whoever last committed it, which on a
+        # shared audit need not be its owner
+        row = conn.execute("SELECT auditor FROM zone_commits WHERE audit_id = ? AND zone = ?", (audit_id, zone)).fetchone()
+        return (row['auditor'] if row else None) or audit['auditor']
+
+    def _apply_rollups(self, conn, audit, zone, delta, sign=1, auditor=None):
+        """
+        Add a score change to the daily and weekly rollups of the audit's day,
+        under auditor or else the audit's owner.
+        """
+        if not any(delta):
+            return
+        auditor = auditor or audit['auditor']
+        delta = Score(*(sign * value for value in delta))
+        for table, period in rollup_keys(_audit_day(audit)):
+            conn.execute(
+                f"""
+                INSERT INTO {table} (period, zone, auditor, {SCORE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (period, zone, auditor) DO UPDATE SET
+                    earned = earned + excluded.earned,
+                    possible = possible + excluded.possible,
+                    answered = answered + excluded.answered,
+                    failed = failed + excluded.failed,
+                    critical_failed = critical_failed + excluded.critical_failed
+                """,
+                (period, zone, auditor, *delta),
+            )
+            conn.execute(
+                f"DELETE FROM {table} WHERE period = ? AND zone = ? AND auditor = ? AND answered <= 0",
+                (period, zone, auditor),
+            )
+
+    def _audit_row(self, conn, audit_id):
+        return conn.execute("SELECT auditor, conducted_on, created_at FROM audits WHERE id = ?", (audit_id,)).fetchone()
+
+    def _zone_score_rows(self, conn, audit_id):
+        rows = conn.execute(f"SELECT zone, {SCORE_COLUMNS} FROM zone_scores WHERE audit_id = ?", (audit_id,)).fetchall()
+        return [(row['zone'], Score(*tuple(row)[1:])) for row in rows]
+
+    def _score(self, conn, table, where, params):
+        row = conn.execute(f"SELECT {SCORE_COLUMNS} FROM {table} WHERE {where}", params).fetchone()
+        return Score(*row) if row else EMPTY_SCORE
+
+    def rebuild_scores(self):
+        """
+        Recompute every running score from the stored responses.
+        """
+        with self.transaction() as conn:
+            for table in ("zone_scores", "audit_scores", "daily_rollups", "weekly_rollups"):
+                conn.execute(f"DELETE FROM {table}")
+            for row in conn.execute("SELECT DISTINCT audit_id, zone FROM responses").fetchall():
+                self._rescore_zone(conn, row['audit_id'], row['zone'])
+
+    def rebuild_search(self):
+        """
+        Rebuild the full-text indexes from the comments and responses tables,
+        needed after a VACUUM since the indexes refer to rowids.
+        """
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO comments_fts (comments_fts) VALUES ('rebuild')")
+            conn.execute("INSERT INTO findings_fts (findings_fts) VALUES ('delete-all')")
+            conn.execute("INSERT INTO findings_fts (rowid, question) SELECT rowid, question FROM responses WHERE answer = 'No'")
+
+    def search(self, text, auditor=None, zone=None, start=None, end=None, limit=50):
+        """
+        Find comments and failed checks matching every word of text, best
+        matches first. Words match by prefix and stem, so "pest" finds "pests".
+        """
+        terms = re.findall(r"\w+", text)
+        if not terms:
+            return []
+        match = " ".join(f'"{term}"*' for term in terms)
+        where, params = _filters(auditor=auditor, zone=zone, start=start, end=end)
+        return self.connection().execute(
+            SEARCH_QUERY.format(where=where),
+            [match, *params, match, *params, limit],
+        ).fetchall()
+
+    def rollups(self, table, since, zones=None, auditor=None):
+        """
+        Read answered and failed counts per period and zone from a rollup table.
+        """
+        import pandas as pd
+
+        query = f"""
+            SELECT period AS "Period", zone AS "Zone", SUM(answered) AS "Answered",
+                   SUM(failed) AS "Failed", SUM(critical_failed) AS "Critical Failures"
+            FROM {table} WHERE period >= ?
+        """
+        params = [_date(since)]
+        if zones:
+            query += f" AND zone IN ({', '.join('?' for _ in zones)})"
+            params += list(zones)
+        if auditor is not None:
+            query += " AND auditor = ?"
+            params.append(auditor)
+        query += " GROUP BY period, zone ORDER BY period, zone"
+        return pd.read_sql_query(query, self.connection(), params=params)
+
+    def audit_score(self, audit_id):
+        return self._score(self.connection(), "audit_scores", "audit_id = ?", (audit_id,))
+
+    def zone_scores(self, audit_id):
+        rows = self.connection().execute(
+            f"SELECT zone, {SCORE_COLUMNS} FROM zone_scores WHERE audit_id = ? ORDER BY zone",
+            (audit_id,),
+        ).fetchall()
+        return {row['zone']: Score(*tuple(row)[1:]) for row in rows}
+
+    def zone_summary(self, auditor=None, zone=None, start=None, end=None):
+        """
+        Running totals summed per zone over the audits matching the filters.
+        """
+        where, params = _filters(auditor=auditor, zone=zone, start=start, end=end)
+        return self.connection().execute(
+            f"""
+            SELECT x.zone, COUNT(*) AS audits, SUM(x.earned) AS earned, SUM(x.possible) AS possible,
+                   SUM(x.answered) AS answered, SUM(x.failed) AS failed, SUM(x.critical_failed) AS critical_failed
+            FROM zone_scores x JOIN audits a ON a.id = x.audit_id
+            WHERE {where}
+            GROUP BY x.zone ORDER BY x.zone
+            """,
+            params,
+        ).fetchall()
+
+    def site_scores(self):
+        """
+        Running totals summed per client site.
+        """
+        return self.connection().execute(
+            """
+            SELECT COALESCE(NULLIF(a.client_site, ''), 'Unspecified') AS site,
+                   SUM(s.earned) AS earned, SUM(s.possible) AS possible,
+                   SUM(s.failed) AS failed, SUM(s.critical_failed) AS critical_failed,
+                   COUNT(*) AS audits
+            FROM audit_scores s JOIN audits a ON a.id = s.audit_id
+            GROUP BY site ORDER BY site
+            """
+        ).fetchall()
+
+    def delete_audit(self, audit_id):
+        with self.transaction() as conn:
+            audit = self._audit_row(conn, audit_id)
+            if audit:
+                for zone, score in self._zone_score_rows(conn, audit_id):
+                    self._apply_rollups(conn, audit, zone, score, -1, self._zone_auditor(conn, audit_id, zone, audit))
+            # Actions raised from the audit's answers go with it unless
+            # someone has worked on them, those are kept without the audit.
+            # Untouched ones orphaned before this rule are swept up too.
+            conn.execute(
+                """
+                DELETE FROM actions WHERE (audit_id = ? OR audit_id IS NULL)
+                  AND source IN ('check', 'comment') AND updated_at IS NULL
+                """,
+                (audit_id,),
+            )
+            conn.execute("DELETE FROM audits WHERE id = ?", (audit_id,))
+
+    def answer_count(self, zone, question_id, answers, since):
+        """
+        How many times a zone's question got one of the answers since a day.
+        """
+        answers = list(answers)
+        return self.connection().execute(
+            f"""
+            SELECT COUNT(*) FROM responses x JOIN audits a ON a.id = x.audit_id
+            WHERE x.question_id = ? AND x.zone = ? AND x.answer IN ({', '.join('?' * len(answers))})
+              AND {AUDIT_DAY} >= ?
+            """,
+            (question_id, zone, *answers, _date(since)),
+        ).fetchone()[0]
+
+    def add_alerts(self, alerts):
+        """
+        Queue alerts in the outbox, skipping any the same audit, zone,
+        question and rule already raised. Returns the ones that were new.
+        """
+        added = []
+        with self.transaction() as conn:
+            for alert in alerts:
+                cursor = conn.execute(
+                    """
+                    INSERT OR IGNORE INTO alerts (audit_id, zone, question_id, rule, severity, message, auditor)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (alert['audit_id'], alert['zone'], alert['question_id'], alert['rule'],
+                     alert['severity'], alert['message'], alert['auditor']),
+                )
+                if cursor.rowcount:
+                    added.append({'id': cursor.lastrowid, **alert})
+        return added
+
+    def open_alerts(self, limit=50):
+        return self.connection().execute(
+            "SELECT * FROM alerts WHERE acknowledged_at IS NULL ORDER BY created_at DESC, id DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+    def open_alert_count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM alerts WHERE acknowledged_at IS NULL").fetchone()[0]
+
+    def acknowledge_alert(self, alert_id, auditor):
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE alerts SET acknowledged_at = CURRENT_TIMESTAMP, acknowledged_by = ? WHERE id = ?",
+                (auditor, alert_id),
+            )
+
+    def previous_zone_audit(self, audit_id, zone):
+        """
+        The latest audit of the same site before this one, by audit day and
+        then id, with answers for the zone. Audits stored before sites were
+        recorded match any site.
+
+        Walks idx_audits_site_day backwards from this audit, once for its site
+        and once for audits without one, and stops at the first audit with a
+        score for the zone, so older history is never read.
+        """
+        conn = self.connection()
+        audit = conn.execute("SELECT conducted_on, created_at, site FROM audits WHERE id = ?", (audit_id,)).fetchone()
+        if audit is None:
+            return None
+        day = _audit_day(audit).isoformat()
+        latest = None
+        for site in {audit['site'], None}:
+            row = conn.execute(
+                f"""
+                SELECT a.id, {AUDIT_DAY} AS day FROM audits a
+                WHERE a.site IS ? AND {AUDIT_DAY} <= ? AND ({AUDIT_DAY} < ? OR a.id < ?)
+                  AND EXISTS (SELECT 1 FROM zone_scores s WHERE s.audit_id = a.id AND s.zone = ?)
+                ORDER BY {AUDIT_DAY} DESC, a.id DESC LIMIT 1
+                """,
+                (site, day, day, audit_id, zone),
+            ).fetchone()
+            if row is not None and (latest is None or (row['day'], row['id']) > (latest['day'], latest['id'])):
+                latest = row
+        return latest['id'] if latest else None
+
+    def zone_detail(self, audit_id, zone):
+        """
+        Answers, comment and photo digests of one zone of an audit, each read
+        by primary key.
+        """
+        conn = self.connection()
+        comment = conn.execute(
+            "SELECT comment FROM comments WHERE audit_id = ? AND zone = ?", (audit_id, zone)
+        ).fetchone()
+        return {
+            'responses': conn.execute(
+                "SELECT question_id, question, answer FROM responses WHERE audit_id = ? AND zone = ? ORDER BY rowid",
+                (audit_id, zone),
+            ).fetchall(),
+            'comment': comment['comment'] if comment else None,
+            'photos': [row['digest'] for row in conn.execute(
+                "SELECT digest FROM photos WHERE audit_id = ? AND zone = ? ORDER BY created_at", (audit_id, zone)
+            )],
+        }
+
+    def add_action(self, zone, description, owner=None, due_on=None, audit_id=None, created_by=None):
+        """
+        Raise a corrective action by hand, due in ACTION_DUE_DAYS['comment']
+        days unless a due date is given.
+        """
+        due_on = due_on or date.today() + timedelta(days=ACTION_DUE_DAYS['comment'])
+        with self.transaction() as conn:
+            if audit_id is not None and conn.execute("SELECT 1 FROM audits WHERE id = ?", (audit_id,)).fetchone() is None:
+                # The audit was deleted meanwhile, keep the action on its own
+                audit_id = None
+            return conn.execute(
+                """
+                INSERT INTO actions (audit_id, zone, source, description, owner, due_on, created_by)
+                VALUES (?, ?, 'manual', ?, ?, ?, ?)
+                """,
+                (audit_id, zone, description, owner, _date(due_on), created_by),
+            ).lastrowid
+
+    def update_action(self, action_id, auditor, owner=None, due_on=None, status=None, verification_photo=None):
+        """
+        Change an action's owner, due date, status or verification photo.
+        Arguments left as None keep their current value.
+        """
+        if status is not None and status not in ACTION_STATUSES:
+            raise ActionError(f"Unknown action status {status!r}")
+        with self.transaction() as conn:
+            action = conn.execute("SELECT * FROM actions WHERE id = ?", (action_id,)).fetchone()
+            if action is None:
+                raise ActionError(f"No corrective action #{action_id}")
+            status = status or action['status']
+            photo = verification_photo or action['verification_photo']
+            if status == "Verified" and not photo:
+                raise ActionError("A corrective action needs a verification photo before it can be verified")
+            conn.execute(
+                """
+                UPDATE actions SET owner = ?, due_on = ?, status = ?, verification_photo = ?,
+                                   updated_at = CURRENT_TIMESTAMP, updated_by = ?,
+                                   closed_at = CASE WHEN ? = 'Verified' THEN COALESCE(closed_at, CURRENT_TIMESTAMP) END
+                WHERE id = ?
+                """,
+                (
+                    action['owner'] if owner is None else owner or None,
+                    _date(due_on) or action['due_on'],
+                    status, photo, auditor, status, action_id,
+                ),
+            )
+
+    def open_actions(self, zones=None, owner=None, due_before=None, site=None, limit=100):
+        """
+        Open corrective actions, soonest due first.
+
+        Each filter is served by one of the partial idx_actions_open_*
+        indexes, which only hold open actions, so this stays an index range
+        read however many actions have been closed. due_before gives the
+        overdue ones. site keeps actions of that site's audits, and those
+        raised without an audit.
+        """
+        where, params = _action_filters(zones, owner, due_before, site)
+        return self.connection().execute(
+            f"SELECT * FROM actions WHERE {where} ORDER BY due_on, id LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+
+    def open_action_count(self, zones=None, owner=None, due_before=None, site=None):
+        where, params = _action_filters(zones, owner, due_before, site)
+        return self.connection().execute(f"SELECT COUNT(*) FROM actions WHERE {where}", params).fetchone()[0]
+
+    def comments(self, audit_id=None):
+        where, params = _filters(audit_id=audit_id)
+        return self.connection().execute(
+            f"SELECT x.zone, x.comment FROM comments x JOIN audits a ON a.id = x.audit_id WHERE {where} ORDER BY x.zone",
+            params,
+        ).fetchall()
+
+    def responses(self, audit_id):
+        return self.connection().execute(
+            """
+            SELECT zone, section, question_id, question, answer FROM responses
+            WHERE audit_id = ? ORDER BY zone, rowid
+            """,
+            (audit_id,),
+        ).fetchall()
+
+    def photos(self, audit_id, zone=None, limit=None, offset=0):
+        """
+        Photo rows of one audit, or of every audit when audit_id is None.
+        """
+        query = "SELECT * FROM photos WHERE 1 = 1"
+        params = []
+        if audit_id is not None:
+            query += " AND audit_id = ?"
+            params.append(audit_id)
+        if zone is not None:
+            query += " AND zone = ?"
+            params.append(zone)
+        query += " ORDER BY zone, created_at"
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        return self.connection().execute(query, params).fetchall()
+
+    def photo_zones(self, audit_id=None):
+        """
+        Number of photos per zone, for one audit or all of them.
+        """
+        where, params = _filters(audit_id=audit_id)
+        return self.connection().execute(
+            f"SELECT x.zone, COUNT(*) AS photos FROM photos x JOIN audits a ON a.id = x.audit_id WHERE {where} GROUP BY x.zone ORDER BY x.zone",
+            params,
+        ).fetchall()
+
+    def _frame_parts(self, kinds, answer, filters):
+        where, params = _filters(**filters)
+        if answer is not None:
+            kinds = ['Answers']
+            where += " AND x.answer = ?"
+            params.append(answer)
+        parts = [FRAME_PARTS[kind] for kind in (kinds or FRAME_PARTS)]
+        return " UNION ALL ".join(parts).format(where=where), params * len(parts)
+
+    def frame_count(self, kinds=None, answer=None, **filters):
+        """
+        Number of frame rows matching the filters, see frame_page.
+        """
+        query, params = self._frame_parts(kinds, answer, filters)
+        return self.connection().execute(f"SELECT COUNT(*) FROM ({query})", params).fetchone()[0]
+
+    def frame_page(self, offset=0, limit=50, kinds=None, answer=None, sort=None, descending=False, **filters):
+        """
+        One page of the flat frame as a DataFrame, filtered, sorted and
+        sliced in SQL so only the rows on the page are ever loaded.
+
+        kinds picks among FRAME_PARTS, answer keeps only answers of that
+        value, and filters are those of query_frame.
+        """
+        import pandas as pd
+
+        query, params = self._frame_parts(kinds, answer, filters)
+        if sort is not None:
+            if sort not in FRAME_SORT_COLUMNS:
+                raise ValueError(f"Cannot sort the audit frame by {sort!r}")
+            query += f' ORDER BY "{sort}" {"DESC" if descending else "ASC"}'
+        query += " LIMIT ? OFFSET ?"
+        return pd.read_sql_query(query, self.connection(), params=params + [limit, offset])
+
+    def query_frame(self, audit_id=None, auditor=None, zone=None, start=None, end=None):
+        """
+        Return the audit rows as a DataFrame, optionally filtered.
+        """
+        import pandas as pd
+
+        where, params = _filters(audit_id, auditor, zone, start, end)
+        return pd.read_sql_query(FRAME_QUERY.format(where=where), self.connection(), params=params * 3)
+
+    def tallies(self, audit_id=None, auditor=None, zone=None, start=None, end=None):
+        """
+        Return answer counts grouped by zone, section, question and answer.
+        """
+        import pandas as pd
+
+        where, params = _filters(audit_id, auditor, zone, start, end)
+        return pd.read_sql_query(TALLY_QUERY.format(where=where), self.connection(), params=params)
+
+    def iter_export(self, columns, chunk_size=5000, audit_id=None, auditor=None, zone=None, start=None, end=None):
+        """
+        Yield export rows in chunks straight from the database cursor.
+
+        Comment and photo rows are only read when their column is selected.
+        """
+        where, params = _filters(audit_id, auditor, zone, start, end)
+        parts = []
+        for table, details in EXPORT_DETAILS.items():
+            if table != 'responses' and not any(column in columns for column in details):
+                continue
+            expressions = {**EXPORT_EXPRESSIONS, **details}
+            select = ", ".join(expressions.get(column, "NULL") for column in columns)
+            parts.append(f"SELECT {select} FROM {table} x JOIN audits a ON a.id = x.audit_id WHERE {where}")
+
+        cursor = self.connection().execute(" UNION ALL ".join(parts), params * len(parts))
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [tuple(row) for row in rows]
+        finally:
+            cursor.close()
+
+    def iter_archive(self, table, chunk_size=50000, start=None, end=None):
+        """
+        Yield one archive table's rows in chunks, for audits whose day falls
+        between start and end.
+        """
+        clauses = ["1 = 1"]
+        params = []
+        if start is not None:
+            clauses.append(f"{AUDIT_DAY} >= ?")
+            params.append(_date(start))
+        if end is not None:
+            clauses.append(f"{AUDIT_DAY} <= ?")
+            params.append(_date(end))
+        cursor = self.connection().execute(f"{ARCHIVE_QUERIES[table]} WHERE {' AND '.join(clauses)}", params)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [tuple(row) for row in rows]
+        finally:
+            cursor.close()
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so two writers never
+    # deadlock trying to upgrade a read lock. Every committed write bumps the
+    # store version so cached analytics know to refresh.
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("UPDATE store_version SET version = version + 1 WHERE id = 1")
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def _date(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _audit_day(audit):
+    return audit_day(audit['conducted_on'], audit['created_at'])
+
+
+def _filters(audit_id=None, auditor=None, zone=None, start=None, end=None):
+    # Filters for queries joining an audits table "a" with a detail table "x"
+    clauses = ["1 = 1"]
+    params = []
+    if audit_id is not None:
+        clauses.append("a.id = ?")
+        params.append(audit_id)
+    if auditor is not None:
+        clauses.append("a.auditor = ?")
+        params.append(auditor)
+    if zone is not None:
+        clauses.append("x.zone = ?")
+        params.append(zone)
+    # Date ranges use the audit day, so audits without a "Conducted on"
+    # date still count on the day they were saved
+    if start is not None:
+        clauses.append(f"{AUDIT_DAY} >= ?")
+        params.append(_date(start))
+    if end is not None:
+        clauses.append(f"{AUDIT_DAY} <= ?")
+        params.append(_date(end))
+    return " AND ".join(clauses), params
+
+
+def _action_filters(zones=None, owner=None, due_before=None, site=None):
+    # Filters on open corrective actions, matching the partial indexes
+    clauses = ["closed_at IS NULL"]
+    params = []
+    if zones is not None:
+        zones = list(zones)
+        clauses.append(f"zone IN ({', '.join('?' * len(zones))})")
+        params += zones
+    if owner is not None:
+        clauses.append("owner = ?")
+        params.append(owner)
+    if due_before is not None:
+        clauses.append("due_on < ?")
+        params.append(_date(due_before))
+    if site is not None:
+        clauses.append("(audit_id IS NULL OR audit_id IN (SELECT id FROM audits WHERE site = ? OR site IS NULL))")
+        params.append(site)
+    return " AND ".join(clauses), params
@@ -0,0 +1,236 @@
+"""
+Session benchmark for app.py driven by streamlit.testing.v1.AppTest.
+
+For each data size the audit store is seeded with that many responses, then a
+scripted auditor session logs in, answers and submits every assigned zone,
+attaches synthetic photos and opens the Analysis and Comments pages. Rerun
+latency, peak RSS and session_state size are written out as JSON. Each size
+runs in its own interpreter with its own data directory, so nothing is shared
+between sizes and no network access is needed.
+
+    python benchmarks/app_sessions.py --sizes 10 1000 100000 --output sessions.json
+"""
+import argparse
+import io
+import json
+import os
+import pickle
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "app.py")
+
+SIZES = (10, 100, 1000, 10000, 100000)
+
+AUDITOR = "felix"
+PASSWORD = "ACL101"
+PHOTOS_PER_ZONE = 2
+
+ANSWERS = ("Yes", "No", "N/A")
+ANSWER_WEIGHTS = (0.8, 0.15, 0.05)
+
+
+def seed_store(store, responses, rng):
+    """
+    Fill the store with roughly the given number of responses, spread over
+    every auditor's zones and the past year.
+    """
+    from app import get_assigned_food_production_zones, get_questions_for_food_production_zone
+
+    auditors = ["callistus kyire", "iddriss nyande", "lovia", "felix"]
+    written = 0
+    day = 0
+    while written < responses:
+        auditor = auditors[day % len(auditors)]
+        audit_id = store.create_audit(auditor, "ACL", conducted_on=date.today() - timedelta(days=day % 365), site="ACL")
+        for zone in get_assigned_food_production_zones(auditor):
+            rows = []
+            for question in get_questions_for_food_production_zone(zone):
+                if written >= responses:
+                    break
+                answer = rng.choices(ANSWERS, ANSWER_WEIGHTS)[0]
+                rows.append({'Location': zone, 'Question ID': question.id, 'Food Production Zone': question.text, 'Answer': answer})
+                written += 1
+            if rng.random() < 0.2:
+                rows.append({'Location': zone, 'Comments': f"Seeded finding {written}"})
+            if rows:
+                store.save_zone(audit_id, zone, rows)
+        day += 1
+
+
+def synthetic_photo(rng, index):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    color = tuple(rng.randrange(256) for _ in range(3))
+    Image.new("RGB", (1600, 1200), color).save(buffer, format="JPEG", quality=85)
+    buffer.seek(0)
+    buffer.name = f"synthetic_{index}.jpg"
+    buffer.type = "image/jpeg"
+    return buffer
+
+
+def session_state_bytes(at):
+    total = 0
+    for value in at.session_state.filtered_state.values():
+        try:
+            total += len(pickle.dumps(value))
+        except Exception:
+            total += sys.getsizeof(value)
+    return total
+
+
+def peak_rss_bytes():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_session(responses, seed=0, timeout=600):
+    """
+    Seed the store and replay one auditor session, returning the measurements.
+    """
+    sys.path.insert(0, ROOT)
+    from streamlit.testing.v1 import AppTest
+
+    from app import get_assigned_food_production_zones, get_questions_for_food_production_zone
+    from audit_store import AuditStore
+    from images import ImagePipeline
+    from photo_store import PhotoStore
+
+    rng = random.Random(seed)
+    store = AuditStore()
+    started = time.perf_counter()
+    seed_store(store, responses, rng)
+    seed_seconds = time.perf_counter() - started
+
+    at = AppTest.from_file(APP, default_timeout=timeout)
+    steps = []
+
+    def step(name, action):
+        started = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - started
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].message}")
+        steps.append({
+            "step": name,
+            "rerun_ms": round(1000 * elapsed, 2),
+            "session_state_bytes": session_state_bytes(at),
+            "peak_rss_bytes": peak_rss_bytes(),
+        })
+
+    step("home", at.run)
+    step("enter name", lambda: at.text_input[0].input(AUDITOR).run())
+    step("enter password", lambda: at.text_input[1].input(PASSWORD).run())
+    step("open audit page", lambda: at.sidebar.radio[0].set_value("Audit").run())
+    step("select zones", lambda: [box for box in at.selectbox if box.label == "Select:"][0].set_value("Food Production Zone").run())
+
+    zones = get_assigned_food_production_zones(AUDITOR)
+    for index, zone in enumerate(zones):
+        for question in get_questions_for_food_production_zone(zone):
+            at.selectbox(key=f"{zone}_fpz_{question.id}").set_value(rng.choices(ANSWERS, ANSWER_WEIGHTS)[0])
+        at.text_area(key=f"comments_{zone}").input(f"Benchmark comment for {zone}")
+        submit = [button for button in at.button if button.label == "Submit"][index]
+        step(f"submit {zone}", lambda: submit.click().run())
+
+    # AppTest cannot drive st.file_uploader, so photos go through the same
+    # store and pipeline calls store_photos makes
+    audit_id = at.session_state["audit_id"]
+    photo_store = PhotoStore()
+    pipeline = ImagePipeline(photo_store)
+    started = time.perf_counter()
+    futures = []
+    for zone in zones:
+        rows = []
+        for i in range(PHOTOS_PER_ZONE):
+            metadata = photo_store.put(synthetic_photo(rng, i))
+            futures.append(pipeline.submit(metadata['Photo']))
+            rows.append(metadata)
+        store.add_photos(audit_id, zone, rows)
+    for future in futures:
+        future.result()
+    photo_seconds = time.perf_counter() - started
+
+    step("rerun audit page", at.run)
+    step("open analysis page", lambda: at.sidebar.radio[0].set_value("Analysis").run())
+    step("rerun analysis page", at.run)
+    step("analysis zone view", lambda: [box for box in at.selectbox if box.label == "Select:"][0].set_value("Food Production Zone").run())
+    step("open comments page", lambda: at.sidebar.radio[0].set_value("Comments and Sign-out").run())
+
+    prepare = [button for button in at.button if button.label == "Prepare audit report"]
+    if prepare:
+        step("request report", lambda: prepare[0].click().run())
+        deadline = time.time() + timeout
+        while not at.get("download_button") and time.time() < deadline:
+            # The sidebar shows open alerts as errors too
+            if at.main.error:
+                raise RuntimeError(f"report: {at.main.error[0].value}")
+            time.sleep(0.1)
+            step("poll report", at.run)
+
+    return {
+        "responses": responses,
+        "seed_seconds": round(seed_seconds, 3),
+        "photo_seconds": round(photo_seconds, 3),
+        "rerun_ms_total": round(sum(item["rerun_ms"] for item in steps), 2),
+        "rerun_ms_max": max(item["rerun_ms"] for item in steps),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "session_state_bytes": session_state_bytes(at),
+        "steps": steps,
+    }
+
+
+def run_in_subprocess(responses, seed):
+    with tempfile.TemporaryDirectory(prefix="acl-bench-") as data_dir:
+        env = dict(os.environ, ACL_DATA_DIR=data_dir)
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", str(responses), "--seed", str(seed)],
+            cwd=ROOT, env=env, capture_output=True, text=True,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"benchmark for {responses} responses failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="numbers of seeded responses")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_session(args.child, seed=args.seed)))
+        return
+
+    import streamlit
+
+    results = []
+    for size in args.sizes:
+        print(f"Running session with {size} responses...", file=sys.stderr)
+        results.append(run_in_subprocess(size, args.seed))
+
+    report = {
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Import-time benchmark for app.py.
+
+Imports the app in fresh interpreters with ``python -X importtime`` and fails
+when a module that only the Analysis or Comments pages need is loaded at
+start-up, or when the median import time goes over the budget.
+
+    python benchmarks/import_time.py --runs 5 --budget-ms 1500 --json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must stay out of the start-up path
+LAZY_MODULES = ('pandas', 'altair', 'pyarrow', 'matplotlib', 'seaborn', 'docx')
+
+
+def measure(module="app"):
+    """
+    Import a module once in a new interpreter and return {package: (self_us, cumulative_us)}.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # One space separates the column from the name, any more is nesting
+        timings[name[1:].rstrip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def at_depth(timings, depth):
+    # Nested imports are indented two spaces per level under their importer
+    return {
+        name.strip(): value for name, value in timings.items()
+        if len(name) - len(name.lstrip(" ")) == 2 * depth
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500.0)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    totals = []
+    timings = {}
+    for _ in range(args.runs):
+        timings = measure(args.module)
+        totals.append(sum(cumulative for _, cumulative in at_depth(timings, 0).values()) / 1000.0)
+
+    loaded = sorted({name.strip().split(".")[0] for name in timings} & set(LAZY_MODULES))
+    # Direct imports of the top-level modules show where start-up time goes
+    heaviest = sorted(at_depth(timings, 1).items(), key=lambda item: item[1][1], reverse=True)[:10]
+    median = statistics.median(totals)
+    report = {
+        "module": args.module,
+        "runs": args.runs,
+        "median_ms": round(median, 1),
+        "min_ms": round(min(totals), 1),
+        "max_ms": round(max(totals), 1),
+        "budget_ms": args.budget_ms,
+        "eager_heavy_modules": loaded,
+        "heaviest": [{"module": name, "cumulative_ms": round(cumulative / 1000.0, 1)} for name, (_, cumulative) in heaviest],
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"import {args.module}: median {median:.1f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+        for item in report["heaviest"]:
+            print(f"  {item['cumulative_ms']:8.1f} ms  {item['module']}")
+        if loaded:
+            print(f"Loaded at start-up but should be lazy: {', '.join(loaded)}")
+
+    if loaded or median > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+from io import BytesIO
+
+import altair as alt
+import pandas as pd
+
+TITLES = {
+    "Location": (
+        "Audit Results by Location:",
+        "Pie Chart of Audit Results:",
+        "Histogram of Audit Data:",
+    ),
+    "Food Production Zone": (
+        "Audit Results by Food Production Zone:",
+        "Pie Chart of Audit Results by Food Production Zone:",
+        "Histogram of Audit Results by Food Production Zone:",
+    ),
+}
+
+
+def chart_tables(summary, view):
+    """
+    Return the (answer table, answer totals) pair a view is drawn from.
+    """
+    if view == "Location":
+        return summary.by_location, summary.answers
+    table = summary.by_question
+    return table, table.sum().sort_values(ascending=False)
+
+
+def _long(table, label):
+    # Tallies in long form, the only data sent to the browser
+    data = table.stack().rename('Count').reset_index()
+    data.columns = [label, 'Answer', 'Count']
+    return data[data['Count'] > 0]
+
+
+def altair_charts(summary, view):
+    """
+    Build the Analysis page charts as Vega-Lite specs from pre-aggregated tallies.
+    """
+    table, answers = chart_tables(summary, view)
+    if table.empty:
+        return []
+
+    # The view name doubles as the category column label
+    label = view
+    titles = TITLES[view]
+    data = _long(table, label)
+    order = list(table.index)
+    x_axis = alt.X(f'{label}:N', sort=order, axis=alt.Axis(labelAngle=-45), title=label)
+
+    totals = table.sum(axis=1).rename('Count').reset_index()
+    totals.columns = [label, 'Count']
+    bar = alt.Chart(totals).mark_bar().encode(x=x_axis, y=alt.Y('Count:Q'), tooltip=[label, 'Count'])
+
+    answer_data = answers.rename('Count').reset_index()
+    answer_data.columns = ['Answer', 'Count']
+    pie = alt.Chart(answer_data).mark_arc().encode(
+        theta=alt.Theta('Count:Q'),
+        color=alt.Color('Answer:N'),
+        tooltip=['Answer', 'Count'],
+    )
+
+    stacked = alt.Chart(data).mark_bar().encode(
+        x=x_axis,
+        y=alt.Y('Count:Q', stack='zero'),
+        color=alt.Color('Answer:N'),
+        tooltip=[label, 'Answer', 'Count'],
+    )
+
+    charts = [(titles[0], bar), (titles[1], pie), (titles[2], stacked)]
+
+    if view == "Location":
+        scatter = alt.Chart(data).mark_circle().encode(
+            x=x_axis,
+            y=alt.Y('Answer:N'),
+            color=alt.Color('Answer:N'),
+            size=alt.Size('Count:Q'),
+            tooltip=[label, 'Answer', 'Count'],
+        )
+        charts.append(("Scatter Plot of Audit Data:", scatter))
+
+    return charts
+
+
+def score_chart(zone_scores):
+    """
+    Bar chart of compliance percentage per zone from the running zone scores.
+    """
+    data = pd.DataFrame(
+        [(zone, 100.0 * score.earned / score.possible, score.critical_failed)
+         for zone, score in zone_scores.items() if score.possible],
+        columns=['Zone', 'Score', 'Critical Failures'],
+    )
+    return alt.Chart(data).mark_bar().encode(
+        x=alt.X('Zone:N', sort='y', axis=alt.Axis(labelAngle=-45)),
+        y=alt.Y('Score:Q', scale=alt.Scale(domain=[0, 100]), title='Score (%)'),
+        color=alt.condition(alt.datum['Critical Failures'] > 0, alt.value('#d62728'), alt.value('#2ca02c')),
+        tooltip=['Zone', alt.Tooltip('Score:Q', format='.1f'), 'Critical Failures'],
+    )
+
+
+def trend_chart(trend, period="Weekly"):
+    """
+    Line chart of non-compliance rate per zone over time from the rollups.
+    """
+    return alt.Chart(trend).mark_line(point=True).encode(
+        x=alt.X('Period:T', title='Week starting' if period == "Weekly" else 'Day'),
+        y=alt.Y('Non-compliance (%):Q', scale=alt.Scale(domain=[0, 100])),
+        color=alt.Color('Zone:N'),
+        tooltip=['Period', 'Zone', 'Answered', 'Failed', 'Critical Failures',
+                 alt.Tooltip('Non-compliance (%):Q', format='.1f')],
+    )
+
+
+def figure_to_png(fig):
+    import matplotlib.pyplot as plt
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    # Close straight away so figures never accumulate in pyplot's registry
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def matplotlib_charts(summary, view):
+    """
+    Render the same charts to PNG with matplotlib, for exporting.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    table, answers = chart_tables(summary, view)
+    if table.empty:
+        return []
+
+    # The view name doubles as the category column label
+    label = view
+    titles = TITLES[view]
+    charts = []
+
+    # Bar plot of answer totals
+    totals = table.sum(axis=1)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    sns.barplot(x=totals.index, y=totals.values, ax=ax)
+    ax.set_xlabel(label)
+    ax.set_ylabel('Count')
+    ax.tick_params(axis='x', labelrotation=45)
+    charts.append((titles[0], figure_to_png(fig)))
+
+    # Pie chart of answers
+    fig, ax = plt.subplots(figsize=(8, 8))
+    ax.pie(answers, labels=answers.index, autopct='%1.1f%%', startangle=140)
+    ax.axis('equal')
+    charts.append((titles[1], figure_to_png(fig)))
+
+    # Stacked histogram of answers
+    fig, ax = plt.subplots(figsize=(10, 6))
+    table.plot(kind='bar', stacked=True, ax=ax)
+    ax.set_xlabel(label)
+    ax.set_ylabel('Count')
+    ax.tick_params(axis='x', labelrotation=45)
+    charts.append((titles[2], figure_to_png(fig)))
+
+    if view == "Location":
+        # Scatter plot of answers per location, sized by count
+        points = _long(table, label)
+        fig, ax = plt.subplots(figsize=(10, 6))
+        sns.scatterplot(data=points, x=label, y='Answer', hue='Answer', size='Count', ax=ax)
+        ax.set_xlabel(label)
+        ax.set_ylabel('Answer')
+        ax.tick_params(axis='x', labelrotation=45)
+        charts.append(("Scatter Plot of Audit Data:", figure_to_png(fig)))
+
+    return charts
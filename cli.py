@@ -0,0 +1,158 @@
+"""
+Headless tools for the audit store, no Streamlit server needed.
+
+    python cli.py ingest exports/*.csv archive/*.parquet --workers 4
+    python cli.py summary --start 2024-01-01 --format csv --output summary.csv
+    python cli.py archive --start 2024-05-01 --end 2024-05-31
+    python cli.py summary --from-archive data/archive --zone "Cold Room"
+    python cli.py diff 42 --against 37
+    python cli.py rebuild
+"""
+import argparse
+import csv
+import json
+import sys
+from datetime import date
+
+from audit_store import AuditStore
+from ingest import ingest
+from scoring import Score, percentage
+
+SUMMARY_COLUMNS = ['Zone', 'Audits', 'Answered', 'Failed Checks', 'Critical Failures', 'Score (%)']
+
+
+def summary_rows(store, auditor=None, zone=None, start=None, end=None):
+    rows = []
+    for row in store.zone_summary(auditor=auditor, zone=zone, start=start, end=end):
+        score = percentage(Score(row['earned'], row['possible'], row['answered'], row['failed'], row['critical_failed']))
+        rows.append([
+            row['zone'], row['audits'], row['answered'], row['failed'], row['critical_failed'],
+            None if score is None else round(score, 1),
+        ])
+    return rows
+
+
+def archive_summary_rows(root, auditor=None, zone=None, start=None, end=None):
+    from archive import archive_zone_scores
+
+    rows = []
+    for name, (audits, score) in archive_zone_scores(root, start=start, end=end, zones=[zone] if zone else None, auditor=auditor).items():
+        value = percentage(score)
+        rows.append([name, audits, score.answered, score.failed, score.critical_failed, None if value is None else round(value, 1)])
+    return rows
+
+
+def write_summary(rows, output_format, out):
+    if output_format == "json":
+        json.dump([dict(zip(SUMMARY_COLUMNS, row)) for row in rows], out, indent=2)
+        out.write("\n")
+    elif output_format == "csv":
+        writer = csv.writer(out)
+        writer.writerow(SUMMARY_COLUMNS)
+        writer.writerows(rows)
+    else:
+        widths = [max(len(str(value)) for value in column) for column in zip(SUMMARY_COLUMNS, *rows)]
+        for row in [SUMMARY_COLUMNS, *rows]:
+            out.write("  ".join(str('-' if value is None else value).ljust(width) for value, width in zip(row, widths)).rstrip() + "\n")
+
+
+def run_ingest(store, args):
+    def progress(path, audits, stats):
+        rejected = sum(count for reason, count in stats.items() if reason not in ('rows', 'duplicate'))
+        print(f"{path}: {stats['rows']} rows, {audits} audits, {rejected} rejected", file=sys.stderr)
+
+    totals = ingest(store, args.files, default_auditor=args.auditor, workers=args.workers, progress=progress)
+    for name, count in sorted(totals.items()):
+        print(f"{name}: {count}")
+
+
+def run_summary(store, args):
+    if args.from_archive:
+        rows = archive_summary_rows(args.from_archive, auditor=args.auditor, zone=args.zone, start=args.start, end=args.end)
+    else:
+        rows = summary_rows(store, auditor=args.auditor, zone=args.zone, start=args.start, end=args.end)
+    if args.output:
+        with open(args.output, "w", newline='', encoding='utf-8') as f:
+            write_summary(rows, args.format, f)
+    else:
+        write_summary(rows, args.format, sys.stdout)
+
+
+def run_archive(store, args):
+    from archive import DEFAULT_ARCHIVE_DIR, write_archive
+
+    root = args.root or DEFAULT_ARCHIVE_DIR
+    write_archive(store, root, start=args.start, end=args.end)
+    print(f"Archived audits from {args.start or 'the first day'} to {args.end or 'the last day'} under {root}")
+
+
+def run_diff(store, args):
+    from diffs import AuditDiffer
+
+    differ = AuditDiffer(store)
+    if args.zone:
+        diffs = {args.zone: differ.diff_zone(args.audit_id, args.zone, args.against)}
+    else:
+        diffs = differ.diff_audit(args.audit_id, args.against)
+    for zone, diff in diffs.items():
+        if diff is None:
+            print(f"{zone}: no earlier audit to compare with")
+            continue
+        print(f"{zone}: compared with audit #{diff.base_audit_id}")
+        for label, changes in (("regression", diff.regressions), ("fixed", diff.fixes), ("changed", diff.changed)):
+            for change in changes:
+                print(f"  {label}: {change.question} ({change.before or '-'} -> {change.after})")
+        for comment in diff.new_comments:
+            print(f"  new comment: {comment}")
+        if diff.new_photos:
+            print(f"  new photos: {len(diff.new_photos)}")
+
+
+def run_rebuild(store, args):
+    store.rebuild_scores()
+    store.rebuild_search()
+    print("Rebuilt scores, rollups and search indexes.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="audit database, defaults to audits.db in ACL_DATA_DIR")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser("ingest", help="load exported CSV or Parquet files into the store")
+    ingest_parser.add_argument("files", nargs="+")
+    ingest_parser.add_argument("--workers", type=int, help="parser processes, one per file up to the CPU count by default")
+    ingest_parser.add_argument("--auditor", default="imported", help="auditor for rows that do not name one")
+    ingest_parser.set_defaults(run=run_ingest)
+
+    summary_parser = commands.add_parser("summary", help="compliance per zone from the stored scores")
+    summary_parser.add_argument("--auditor", type=str.lower)
+    summary_parser.add_argument("--zone")
+    summary_parser.add_argument("--start", type=date.fromisoformat)
+    summary_parser.add_argument("--end", type=date.fromisoformat)
+    summary_parser.add_argument("--format", choices=["text", "csv", "json"], default="text")
+    summary_parser.add_argument("--output", help="write to this file instead of stdout")
+    summary_parser.add_argument("--from-archive", metavar="DIR", help="read a Parquet archive instead of the store")
+    summary_parser.set_defaults(run=run_summary)
+
+    archive_parser = commands.add_parser("archive", help="write Parquet datasets partitioned by day and zone")
+    archive_parser.add_argument("--root", help="archive directory, defaults to archive in ACL_DATA_DIR")
+    archive_parser.add_argument("--start", type=date.fromisoformat)
+    archive_parser.add_argument("--end", type=date.fromisoformat)
+    archive_parser.set_defaults(run=run_archive)
+
+    diff_parser = commands.add_parser("diff", help="answers, comments and photos that changed between two audits")
+    diff_parser.add_argument("audit_id", type=int)
+    diff_parser.add_argument("--against", type=int, help="audit to compare with, the previous audit of each zone by default")
+    diff_parser.add_argument("--zone")
+    diff_parser.set_defaults(run=run_diff)
+
+    rebuild_parser = commands.add_parser("rebuild", help="recompute scores, rollups and search indexes")
+    rebuild_parser.set_defaults(run=run_rebuild)
+
+    args = parser.parse_args(argv)
+    args.run(AuditStore(args.db), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+# One answer that differs between two audits of a zone
+AnswerChange = namedtuple('AnswerChange', ['question_id', 'question', 'before', 'after'])
+
+ZoneDiff = namedtuple('ZoneDiff', [
+    'zone', 'base_audit_id', 'audit_id',
+    'regressions', 'fixes', 'changed', 'new_comments', 'new_photos',
+])
+
+
+def _question_key(row):
+    # Answers are matched on the checklist's stable question id, and on the
+    # wording only for rows saved before question ids existed
+    return row['question_id'] or row['question']
+
+
+def _comment_lines(comment):
+    return [line.strip() for line in (comment or '').splitlines() if line.strip()]
+
+
+def diff_zone_detail(zone, base_audit_id, audit_id, base, current):
+    """
+    Compare two zone_detail results of the same zone.
+
+    A regression is a check that failed this time and did not fail before,
+    a fix is one that failed before and passes now. Any other change of
+    answer, including questions answered for the first time, is listed as
+    changed.
+    """
+    before = {_question_key(row): row['answer'] for row in base['responses']}
+    regressions, fixes, changed = [], [], []
+    for row in current['responses']:
+        previous = before.get(_question_key(row))
+        if previous == row['answer']:
+            continue
+        change = AnswerChange(row['question_id'], row['question'], previous, row['answer'])
+        if row['answer'] == "No" and previous is not None:
+            regressions.append(change)
+        elif previous == "No" and row['answer'] == "Yes":
+            fixes.append(change)
+        else:
+            changed.append(change)
+
+    old_lines = set(_comment_lines(base['comment']))
+    old_photos = set(base['photos'])
+    return ZoneDiff(
+        zone, base_audit_id, audit_id, regressions, fixes, changed,
+        [line for line in _comment_lines(current['comment']) if line not in old_lines],
+        [digest for digest in current['photos'] if digest not in old_photos],
+    )
+
+
+class AuditDiffer:
+    """
+    Diff zones between audits and keep the results by audit revision.
+
+    Every lookup is by primary key or index, and a diff is only recomputed
+    after either audit changes.
+    """
+
+    def __init__(self, store, max_cached=256):
+        self.store = store
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def diff_zone(self, audit_id, zone, base_audit_id=None):
+        """
+        Diff a zone against another audit, by default the previous audit of
+        that zone. Returns None when there is nothing to compare with.
+        """
+        if base_audit_id is None:
+            base_audit_id = self.store.previous_zone_audit(audit_id, zone)
+            if base_audit_id is None:
+                return None
+        key = (audit_id, zone, base_audit_id, self.store.revision(audit_id), self.store.revision(base_audit_id))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        diff = diff_zone_detail(
+            zone, base_audit_id, audit_id,
+            self.store.zone_detail(base_audit_id, zone), self.store.zone_detail(audit_id, zone),
+        )
+        with self._lock:
+            self._cache[key] = diff
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return diff
+
+    def diff_audit(self, audit_id, base_audit_id=None):
+        """
+        Diffs of every scored zone of an audit, keyed by zone.
+        """
+        diffs = {}
+        for zone in self.store.zone_scores(audit_id):
+            diff = self.diff_zone(audit_id, zone, base_audit_id)
+            if diff is not None:
+                diffs[zone] = diff
+        return diffs
@@ -0,0 +1,57 @@
+import csv
+import io
+from tempfile import SpooledTemporaryFile
+
+from audit_store import EXPORT_COLUMNS
+
+DEFAULT_EXPORT_COLUMNS = [column for column in EXPORT_COLUMNS if column != 'Photo']
+
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+# Exports larger than this are spooled to a temporary file on disk
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def write_csv(chunks, columns, out):
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+    text.flush()
+    # Hand the underlying file back to the caller open
+    text.detach()
+
+
+def write_parquet(chunks, columns, out):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    fields = [pa.field(column, pa.int64() if column == 'Audit ID' else pa.string()) for column in columns]
+    schema = pa.schema(fields)
+    with pq.ParquetWriter(out, schema) as writer:
+        for rows in chunks:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), fields)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+def export_audits(store, columns, export_format="CSV", chunk_size=5000, **filters):
+    """
+    Stream the selected columns into a CSV or Parquet file chunk by chunk.
+
+    Rows go from the database cursor to a spooled file without building a
+    DataFrame, so only the finished file is ever held as one piece.
+    """
+    columns = [column for column in EXPORT_COLUMNS if column in columns]
+    chunks = store.iter_export(columns, chunk_size=chunk_size, **filters)
+    out = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    if export_format == "Parquet":
+        write_parquet(chunks, columns, out)
+    else:
+        write_csv(chunks, columns, out)
+    out.seek(0)
+    with out:
+        return out.read()
@@ -0,0 +1,99 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+# Longest edge in pixels for each rendition, None keeps the full resolution
+RENDITIONS = {
+    'thumbnail': 256,
+    'preview': 1280,
+    'original': None,
+}
+
+QUALITY = {
+    'thumbnail': 70,
+    'preview': 80,
+    'original': 90,
+}
+
+# WebP is smaller, but fall back to JPEG on Pillow builds without it
+FORMAT, EXTENSION = ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def rendition_path(photo_store, digest, name):
+    return os.path.join(photo_store.root, 'renditions', digest[:2], digest, f"{name}.{EXTENSION}")
+
+
+def make_renditions(photo_store, digest):
+    """
+    Decode a stored photo once and write every rendition of it.
+
+    EXIF orientation is applied to the pixels and no metadata is copied, so
+    the renditions carry no camera or location details.
+    """
+    with Image.open(photo_store.path_for(digest)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        paths = {}
+        for name, size in RENDITIONS.items():
+            path = rendition_path(photo_store, digest, name)
+            paths[name] = path
+            if os.path.exists(path):
+                continue
+            rendition = image.copy()
+            if size is not None:
+                rendition.thumbnail((size, size))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.part"
+            rendition.save(tmp_path, format=FORMAT, quality=QUALITY[name])
+            os.replace(tmp_path, path)
+        return paths
+
+
+class ImagePipeline:
+    """
+    Produce photo renditions on a bounded pool of worker threads.
+
+    Submitting a photo that is already queued returns the existing future, so
+    re-uploads are never processed twice at the same time.
+    """
+
+    def __init__(self, photo_store, max_workers=2):
+        self.photo_store = photo_store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="images")
+        self._pending = {}
+        self._failed = set()
+        # Reentrant because a future that is already done runs its callback
+        # straight away, while submit still holds the lock
+        self._lock = threading.RLock()
+
+    def submit(self, digest):
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is None:
+                future = self._executor.submit(make_renditions, self.photo_store, digest)
+                self._pending[digest] = future
+                future.add_done_callback(lambda done: self._done(digest, done))
+            return future
+
+    def _done(self, digest, future):
+        with self._lock:
+            self._pending.pop(digest, None)
+            if future.exception() is not None:
+                # Not an image Pillow can read, don't keep retrying it
+                self._failed.add(digest)
+
+    def path(self, digest, name='thumbnail'):
+        """
+        Path of a finished rendition, or None while it is still being made.
+        """
+        path = rendition_path(self.photo_store, digest, name)
+        if os.path.exists(path):
+            return path
+        if digest not in self._pending and digest not in self._failed and self.photo_store.exists(digest):
+            # Stored before the pipeline existed or queued before a restart
+            self.submit(digest)
+        return None
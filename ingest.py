@@ -0,0 +1,212 @@
+import base64
+import binascii
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+from PIL import Image, UnidentifiedImageError
+
+from checklists import get_checklist_registry, response_row
+from photo_store import PhotoStore
+from site_config import load_site_config
+
+ANSWERS = ("Yes", "No", "N/A")
+
+# Rows read from a Parquet file at a time
+BATCH_ROWS = 50000
+
+# Photo cells of the export hold a stored photo's digest, those of the old
+# "Download CSV" frame the base64 image itself
+DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+def iter_rows(path):
+    """
+    Stream the rows of a CSV or Parquet file as dicts.
+    """
+    if path.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=BATCH_ROWS):
+            yield from batch.to_pylist()
+        return
+
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def _text(row, column):
+    value = row.get(column)
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _day(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value[:10]).isoformat()
+    except ValueError:
+        return None
+
+
+def _photo(photo_store, cell):
+    """
+    The photo row for a Photo cell, storing a base64 image first, or None if
+    the cell is neither a stored digest nor an image.
+    """
+    if DIGEST.fullmatch(cell):
+        return {'Photo': cell} if photo_store.exists(cell) else None
+    try:
+        data = io.BytesIO(base64.b64decode(cell, validate=True))
+        # Only the header is parsed, to keep anything but images out of the store
+        with Image.open(data) as image:
+            mime_type = Image.MIME.get(image.format)
+    except (binascii.Error, ValueError, UnidentifiedImageError, OSError):
+        return None
+    return {**photo_store.put(data), 'MIME Type': mime_type}
+
+
+def parse_file(path, default_auditor):
+    """
+    Validate one exported file against the checklist and group it into audits.
+
+    Files from the export carry an Audit ID per row; the older "Download CSV"
+    frame does not, so all of its rows become one audit, and its photos are
+    decoded from base64 into the photo store. Zones are looked up
+    in the site configuration first, so a zone configured under its own name
+    is accepted. Runs in a worker process and returns plain data.
+    """
+    registry = get_checklist_registry()
+    config = load_site_config(registry=registry)
+    photo_store = PhotoStore()
+    stats = Counter()
+    audits = {}
+
+    for row in iter_rows(path):
+        stats['rows'] += 1
+        location = _text(row, 'Location')
+        auditor = _text(row, 'Auditor').lower() or default_auditor
+        # Files without a Site column belong to the auditor's site, or to
+        # the first site with the zone
+        site = _text(row, 'Site') or config.site_for(auditor) or config.zone_site(location)
+        zone = location
+        questions = config.checklist(zone, site)
+        if not questions:
+            questions = registry.questions(location)
+            if not questions:
+                stats['unknown zone'] += 1
+                continue
+            zone = questions[0].zone
+
+        conducted_on = _day(_text(row, 'Conducted On'))
+        if _text(row, 'Conducted On') and conducted_on is None:
+            stats['invalid date'] += 1
+        key = (
+            _text(row, 'Audit ID'),
+            auditor,
+            _text(row, 'Client / Site') or None,
+            conducted_on,
+            site,
+        )
+        audit = audits.setdefault(key, {'answers': {}, 'comments': {}, 'photos': {}})
+
+        answer = _text(row, 'Answer')
+        comment = _text(row, 'Comments')
+        photo = _text(row, 'Photo')
+        if answer:
+            question = {question.id: question for question in questions}.get(_text(row, 'Question ID'))
+            if question is None:
+                question = registry.find(questions[0].zone, _text(row, 'Question') or _text(row, 'Food Production Zone'))
+            if question is None:
+                stats['unknown question'] += 1
+            elif answer not in ANSWERS:
+                stats['invalid answer'] += 1
+            else:
+                if (zone, question.id) in audit['answers']:
+                    stats['duplicate'] += 1
+                audit['answers'][zone, question.id] = answer
+        elif comment:
+            comments = audit['comments'].setdefault(zone, [])
+            if comment in comments:
+                stats['duplicate'] += 1
+            else:
+                comments.append(comment)
+        elif photo:
+            metadata = _photo(photo_store, photo)
+            if metadata is not None:
+                audit['photos'].setdefault(zone, {})[metadata['Photo']] = metadata
+            elif DIGEST.fullmatch(photo):
+                stats['missing photo'] += 1
+            else:
+                stats['invalid photo'] += 1
+        else:
+            stats['empty'] += 1
+
+    results = []
+    for (_, auditor, client_site, conducted_on, site), audit in audits.items():
+        zones = {}
+        for (zone, qid), answer in audit['answers'].items():
+            # Filed under the configured zone, which may share another
+            # zone's checklist
+            zones.setdefault(zone, []).append({**response_row(registry.question(qid), answer), 'Location': zone})
+        for zone, comments in audit['comments'].items():
+            zones.setdefault(zone, []).append({'Location': zone, 'Comments': "\n".join(comments)})
+        for zone, photos in audit['photos'].items():
+            zones.setdefault(zone, []).extend({'Location': zone, **photos[digest]} for digest in sorted(photos))
+        if not zones:
+            continue
+        results.append({
+            'batch_id': import_key(auditor, client_site, conducted_on, zones),
+            'auditor': auditor,
+            'client_site': client_site,
+            'conducted_on': conducted_on,
+            'site': site,
+            'zones': zones,
+        })
+    return path, results, stats
+
+
+def import_key(auditor, client_site, conducted_on, zones):
+    """
+    Content hash of an imported audit, so the same audit found in several
+    files or imported twice is only stored once.
+    """
+    content = json.dumps(
+        [auditor, client_site, conducted_on, {zone: sorted(rows, key=json.dumps) for zone, rows in zones.items()}],
+        sort_keys=True,
+    )
+    return "import:" + hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def ingest(store, paths, default_auditor="imported", workers=None, progress=None):
+    """
+    Parse files on a process pool and write their audits to the store.
+
+    Parsing and validation run in parallel. Every write goes through this
+    process, because SQLite only has one writer at a time.
+    """
+    totals = Counter()
+    workers = workers or min(len(paths), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = [pool.submit(parse_file, path, default_auditor) for path in paths]
+        for future in as_completed(futures):
+            path, audits, stats = future.result()
+            totals.update(stats)
+            totals['files'] += 1
+            for audit in audits:
+                audit_id = store.import_audit(
+                    audit['batch_id'], audit['auditor'], audit['zones'],
+                    client_site=audit['client_site'], conducted_on=audit['conducted_on'], site=audit['site'],
+                )
+                totals['audits imported' if audit_id is not None else 'audits already imported'] += 1
+            if progress is not None:
+                progress(path, len(audits), stats)
+    return totals
@@ -0,0 +1,97 @@
+import base64
+import gzip
+import json
+import os
+
+import streamlit.components.v1 as components
+
+from checklists import response_row
+
+ANSWERS = ("Yes", "No", "N/A")
+
+COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "offline_queue")
+
+# Largest decompressed batch accepted from a client
+MAX_BATCH_BYTES = 2 * 1024 * 1024
+
+# Quiet period after the last change before the client sends a batch
+SYNC_DELAY_MS = 3000
+
+_component = components.declare_component("offline_queue", path=COMPONENT_DIR)
+
+
+class BatchError(ValueError):
+    pass
+
+
+def offline_capture(storage_key, zones, audit_id=None, acked=(), options=ANSWERS, key=None):
+    """
+    Render the offline answer journal for the given Question records per zone.
+
+    Returns the last batch the client sent, or None before the first sync.
+    """
+    return _component(
+        storage_key=storage_key,
+        zones=[
+            {'zone': zone, 'questions': [{'id': question.id, 'text': question.text} for question in questions]}
+            for zone, questions in zones.items()
+        ],
+        audit_id=audit_id,
+        acked=list(acked),
+        options=list(options),
+        sync_delay_ms=SYNC_DELAY_MS,
+        key=key,
+        default=None,
+    )
+
+
+def decode_batch(batch):
+    """
+    Unpack the entries of a batch sent by the client.
+    """
+    if batch.get('encoding') == 'gzip':
+        try:
+            raw = gzip.decompress(base64.b64decode(batch['payload']))
+        except (OSError, ValueError) as exc:
+            raise BatchError(f"Batch {batch.get('batch_id')} could not be decompressed") from exc
+    else:
+        raw = batch['payload'].encode('utf-8')
+    if len(raw) > MAX_BATCH_BYTES:
+        raise BatchError(f"Batch {batch.get('batch_id')} is larger than {MAX_BATCH_BYTES} bytes")
+    try:
+        entries = json.loads(raw)
+    except ValueError as exc:
+        raise BatchError(f"Batch {batch.get('batch_id')} is not valid JSON") from exc
+    if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+        raise BatchError(f"Batch {batch.get('batch_id')} is not a list of entries")
+    return entries
+
+
+def batch_rows(entries, checklists, options=ANSWERS):
+    """
+    Collapse queued entries into the zone rows save_zone takes, given the
+    Question records of each zone.
+
+    Only the latest entry for each answer or comment counts, and entries for
+    zones, questions or answers the checklist does not have are dropped.
+    """
+    latest = {}
+    for entry in sorted(entries, key=lambda entry: entry.get('at', 0)):
+        slot = (str(entry.get('zone')), str(entry.get('question_id') or 'comment'))
+        latest[slot] = entry
+
+    zones = {}
+    for (zone, slot), entry in latest.items():
+        questions = {question.id: question for question in checklists.get(zone, ())}
+        if not questions:
+            continue
+        if slot == 'comment':
+            zones.setdefault(zone, []).append({'Location': zone, 'Comments': entry.get('comment') or None})
+            continue
+        question = questions.get(slot)
+        if question is None or entry.get('answer') not in options:
+            continue
+        # A zone can share another zone's checklist, so the row is filed
+        # under the zone the answer was given for
+        zones.setdefault(zone, []).append({**response_row(question, entry['answer']), 'Location': zone})
+    return zones
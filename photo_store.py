@@ -0,0 +1,84 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from PIL import Image, UnidentifiedImageError
+
+# Size of each read when streaming an upload to disk
+CHUNK_SIZE = 64 * 1024
+
+DEFAULT_DATA_DIR = os.environ.get("ACL_DATA_DIR", "data")
+
+
+class PhotoStore:
+    """
+    Content-addressed photo storage on local disk.
+
+    Photos are written once under their SHA-256 digest, so uploading the same
+    image twice only stores it once. Audit rows keep the digest and metadata.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.path.join(DEFAULT_DATA_DIR, "photos")
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, digest):
+        # Fan out by the first two hex characters to keep directories small
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def open(self, digest):
+        return open(self.path_for(digest), "rb")
+
+    def put(self, uploaded_file):
+        """
+        Stream an uploaded file to disk in chunks and return its metadata.
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+
+        uploaded_file.seek(0)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                for chunk in iter(lambda: uploaded_file.read(CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+                    tmp_file.write(chunk)
+                    size += len(chunk)
+
+            digest = sha256.hexdigest()
+            path = self.path_for(digest)
+            if os.path.exists(path):
+                # Already stored, drop the duplicate
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        name = getattr(uploaded_file, "name", None)
+        mime_type = getattr(uploaded_file, "type", None) or mimetypes.guess_type(name or "")[0]
+        width, height = self._dimensions(path)
+
+        return {
+            'Photo': digest,
+            'Filename': name,
+            'Size': size,
+            'MIME Type': mime_type,
+            'Width': width,
+            'Height': height,
+        }
+
+    def _dimensions(self, path):
+        # Image.open only parses the header, the pixel data is never decoded
+        try:
+            with Image.open(path) as image:
+                return image.size
+        except (UnidentifiedImageError, OSError):
+            return None, None
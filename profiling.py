@@ -0,0 +1,167 @@
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+# Streamlit runs each session's script on its own thread, so the profiler for
+# the rerun in progress is looked up per thread
+_current = threading.local()
+
+MODES = ("timers", "alloc", "profile")
+
+# tracemalloc is process wide. It runs only while at least one rerun in
+# alloc or profile mode is in progress, and _trace_epoch changes whenever a
+# rerun starts using it, so a rerun can tell if it had the peak to itself.
+_trace_lock = threading.Lock()
+_trace_users = 0
+_trace_epoch = 0
+
+
+def _start_tracing():
+    global _trace_users, _trace_epoch
+    with _trace_lock:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _trace_users += 1
+        _trace_epoch += 1
+        if _trace_users == 1:
+            tracemalloc.reset_peak()
+        return _trace_epoch
+
+
+def _stop_tracing(epoch):
+    """
+    Release tracemalloc and return the peak in KiB, or None when another
+    rerun traced at the same time and the peak is not this rerun's alone.
+    """
+    global _trace_users
+    with _trace_lock:
+        peak = None
+        if _trace_users == 1 and epoch == _trace_epoch:
+            peak = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        _trace_users -= 1
+        if _trace_users == 0:
+            tracemalloc.stop()
+        return peak
+
+
+def current_profiler():
+    return getattr(_current, "profiler", None)
+
+
+def stage(name):
+    """
+    Time a block as one stage of the current rerun, a no-op when disabled.
+    """
+    profiler = getattr(_current, "profiler", None)
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+
+def profiled(name=None):
+    """
+    Decorator recording every call of a function as a stage.
+    """
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = getattr(_current, "profiler", None)
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.stage(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RerunProfiler:
+    """
+    Record wall time, and optionally allocations and a cProfile summary, for
+    each stage of the last few reruns of one session.
+
+    mode is "timers", "alloc" (adds tracemalloc) or "profile" (adds cProfile
+    on every profile_every-th rerun).
+    """
+
+    def __init__(self, mode="timers", history=20, profile_every=5, log_path=None):
+        self.mode = mode
+        self.profile_every = profile_every
+        self.log_path = log_path
+        self.reruns = deque(maxlen=history)
+        self.count = 0
+        self._record = None
+        self._depth = 0
+        self._tracing = False
+
+    @contextmanager
+    def rerun(self, page):
+        self.count += 1
+        self._record = record = {
+            "rerun": self.count,
+            "page": page,
+            "started": time.time(),
+            "stages": [],
+        }
+        self._tracing = self.mode in ("alloc", "profile")
+        epoch = _start_tracing() if self._tracing else None
+        profile = None
+        if self.mode == "profile" and self.count % self.profile_every == 1:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        _current.profiler = self
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["total_ms"] = round(1000 * (time.perf_counter() - started), 3)
+            _current.profiler = None
+            if profile is not None:
+                profile.disable()
+                out = io.StringIO()
+                pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(20)
+                record["profile"] = out.getvalue()
+            if self._tracing:
+                peak = _stop_tracing(epoch)
+                if peak is not None:
+                    record["traced_peak_kb"] = peak
+            self.reruns.append(record)
+            self._record = None
+            self._write(record)
+
+    @contextmanager
+    def stage(self, name):
+        # Entries are added when a stage starts, so nested stages follow
+        # their parent in the record
+        entry = {"stage": name, "depth": self._depth}
+        if self._record is not None:
+            self._record["stages"].append(entry)
+        tracing = self._tracing and tracemalloc.is_tracing()
+        memory_before = tracemalloc.get_traced_memory()[0] if tracing else 0
+        self._depth += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry["ms"] = round(1000 * (time.perf_counter() - started), 3)
+            self._depth -= 1
+            if tracing:
+                entry["alloc_kb"] = round((tracemalloc.get_traced_memory()[0] - memory_before) / 1024, 1)
+
+    def _write(self, record):
+        if not self.log_path:
+            return
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def to_jsonl(self):
+        return "".join(json.dumps(record) + "\n" for record in self.reruns)
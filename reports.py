@@ -0,0 +1,163 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from docx import Document
+from docx.image.exceptions import UnrecognizedImageError
+from docx.shared import Inches, RGBColor
+from PIL import Image
+
+from diffs import AuditDiffer
+from images import rendition_path
+from scoring import percentage
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+THUMBNAIL_SIZE = (320, 320)
+
+REGRESSION_COLOR = RGBColor(0xC0, 0x00, 0x00)
+
+
+def _thumbnail(photo_store, digest):
+    # Start from the pipeline's thumbnail when it is ready. It is re-encoded
+    # as JPEG because Word documents cannot embed WebP.
+    path = rendition_path(photo_store, digest, 'thumbnail')
+    if not os.path.exists(path):
+        path = photo_store.path_for(digest)
+    with Image.open(path) as image:
+        image.thumbnail(THUMBNAIL_SIZE)
+        buffer = BytesIO()
+        image.convert('RGB').save(buffer, format='JPEG', quality=80)
+    buffer.seek(0)
+    return buffer
+
+
+def build_audit_report(store, photo_store, audit_id, differ=None):
+    """
+    Render a full audit report as DOCX bytes, entirely in memory.
+    """
+    differ = differ or AuditDiffer(store)
+    audit = store.get_audit(audit_id) or {}
+    responses = store.responses(audit_id)
+    comments = {row['zone']: row['comment'] for row in store.comments(audit_id)}
+    photos = {}
+    for row in store.photos(audit_id):
+        photos.setdefault(row['zone'], []).append(row)
+
+    zones = []
+    for row in responses:
+        if row['zone'] not in zones:
+            zones.append(row['zone'])
+    zones += [zone for zone in list(comments) + list(photos) if zone not in zones]
+
+    document = Document()
+    document.add_heading('Airways Catering Limited Audit Report', level=0)
+    for label, key in [
+        ('Prepared by', 'auditor'),
+        ('Client / Site', 'client_site'),
+        ('Location', 'location'),
+        ('Position at ACL', 'position'),
+        ('Conducted on', 'conducted_on'),
+    ]:
+        value = audit.get(key)
+        if key == 'auditor' and value:
+            value = value.title()
+        document.add_paragraph(f"{label}: {value or '-'}")
+    contributors = sorted({row['auditor'] for row in store.zone_commits(audit_id) if row['auditor']})
+    if contributors:
+        document.add_paragraph(f"Contributors: {', '.join(name.title() for name in contributors)}")
+
+    zone_scores = store.zone_scores(audit_id)
+    audit_score = store.audit_score(audit_id)
+    score = percentage(audit_score)
+    document.add_heading('Compliance Score', level=1)
+    if score is None:
+        document.add_paragraph("No scored answers.")
+    else:
+        document.add_paragraph(f"{score:.1f}% ({audit_score.failed} failed checks, {audit_score.critical_failed} critical)")
+
+    for zone in zones:
+        document.add_heading(zone, level=1)
+        zone_rows = [row for row in responses if row['zone'] == zone]
+        if zone_rows:
+            zone_score = percentage(zone_scores.get(zone))
+            if zone_score is not None:
+                document.add_paragraph(f"Zone score: {zone_score:.1f}%")
+            table = document.add_table(rows=1, cols=2)
+            table.style = 'Table Grid'
+            table.rows[0].cells[0].text = 'Question'
+            table.rows[0].cells[1].text = 'Answer'
+            for row in zone_rows:
+                cells = table.add_row().cells
+                cells[0].text = row['question']
+                cells[1].text = row['answer'] or ''
+
+        diff = differ.diff_zone(audit_id, zone)
+        if diff is not None and (diff.regressions or diff.fixes):
+            document.add_heading(f'Changes since audit #{diff.base_audit_id}', level=2)
+            for change in diff.regressions:
+                run = document.add_paragraph(style='List Bullet').add_run(
+                    f"Regression: {change.question} ({change.before} → {change.after})"
+                )
+                run.bold = True
+                run.font.color.rgb = REGRESSION_COLOR
+            for change in diff.fixes:
+                document.add_paragraph(f"Fixed: {change.question}", style='List Bullet')
+
+        if zone in comments:
+            document.add_heading('Comments', level=2)
+            document.add_paragraph(comments[zone])
+
+        if zone in photos:
+            document.add_heading('Photos', level=2)
+            for photo in photos[zone]:
+                if not photo_store.exists(photo['digest']):
+                    continue
+                try:
+                    document.add_picture(_thumbnail(photo_store, photo['digest']), width=Inches(2))
+                except (OSError, UnrecognizedImageError):
+                    document.add_paragraph(f"Photo {photo['filename'] or photo['digest']} could not be read.")
+
+    buffer = BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+class ReportRenderer:
+    """
+    Render reports on worker threads and keep the results by audit revision.
+
+    Asking again for an unchanged audit returns the same future, so a report
+    is only ever built once per revision.
+    """
+
+    def __init__(self, store, photo_store, max_workers=2, max_cached=16, differ=None):
+        self.store = store
+        self.photo_store = photo_store
+        self.differ = differ or AuditDiffer(store)
+        self.max_cached = max_cached
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report")
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def request(self, audit_id):
+        key = (audit_id, self.store.revision(audit_id))
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._executor.submit(build_audit_report, self.store, self.photo_store, audit_id, self.differ)
+                self._futures[key] = future
+            self._futures.move_to_end(key)
+            while len(self._futures) > self.max_cached:
+                self._futures.popitem(last=False)
+            return future
+
+    def get(self, audit_id):
+        """
+        Return the future for the audit's current revision if one was requested.
+        """
+        key = (audit_id, self.store.revision(audit_id))
+        with self._lock:
+            return self._futures.get(key)
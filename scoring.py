@@ -0,0 +1,85 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from checklists import get_checklist_registry
+
+# Points for each answer, N/A is not scored at all
+ANSWER_SCORES = {"Yes": 1.0, "No": 0.0}
+
+DEFAULT_WEIGHT = 1.0
+CRITICAL_WEIGHT = 3.0
+
+# Questions containing any of these phrases are critical food safety checks
+CRITICAL_PHRASES = (
+    '0-5 degrees celsius',
+    'correct temperature',
+    'required temperature',
+    'temperature within the acceptable range',
+    'signs of pest infestation',
+    'cross-contamination',
+)
+
+# Explicit weights by question id, these win over the phrases above
+WEIGHT_OVERRIDES = {}
+
+Score = namedtuple('Score', ['earned', 'possible', 'answered', 'failed', 'critical_failed'])
+
+EMPTY_SCORE = Score(0.0, 0.0, 0, 0, 0)
+
+
+def is_critical_text(text):
+    text = text.casefold()
+    return any(phrase in text for phrase in CRITICAL_PHRASES)
+
+
+@lru_cache(maxsize=None)
+def get_question_weights():
+    """
+    Weight of every checklist question by id, computed once per process.
+    """
+    weights = {}
+    for qid, question in get_checklist_registry().by_id.items():
+        weights[qid] = CRITICAL_WEIGHT if is_critical_text(question.text) else DEFAULT_WEIGHT
+    weights.update(WEIGHT_OVERRIDES)
+    return weights
+
+
+def question_weight(question_id, text=None):
+    weight = get_question_weights().get(question_id)
+    if weight is None:
+        weight = CRITICAL_WEIGHT if text and is_critical_text(text) else DEFAULT_WEIGHT
+    return weight
+
+
+def score_answers(answers):
+    """
+    Score (question id, question text, answer) triples for one zone.
+    """
+    earned = possible = 0.0
+    answered = failed = critical_failed = 0
+    for question_id, text, answer in answers:
+        points = ANSWER_SCORES.get(answer)
+        if points is None:
+            continue
+        weight = question_weight(question_id, text)
+        earned += points * weight
+        possible += weight
+        answered += 1
+        if answer == "No":
+            failed += 1
+            if weight >= CRITICAL_WEIGHT:
+                critical_failed += 1
+    return Score(earned, possible, answered, failed, critical_failed)
+
+
+def combine(total, delta, sign=1):
+    """
+    Add (or with sign=-1 remove) a zone score to a running total.
+    """
+    return Score(*(value + sign * change for value, change in zip(total, delta)))
+
+
+def percentage(score):
+    if not score or not score.possible:
+        return None
+    return 100.0 * score.earned / score.possible
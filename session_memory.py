@@ -0,0 +1,72 @@
+import os
+import pickle
+import sys
+import threading
+import time
+
+# Bytes of session_state one browser session may hold before finished zones
+# are released, answers and photos are already in the audit and photo stores
+SESSION_BUDGET = int(os.environ.get("ACL_SESSION_BUDGET", 16 * 1024 * 1024))
+
+# Sessions that have not rerun for this long no longer count towards the
+# worker total
+SESSION_TTL = 60 * 60
+
+
+def value_bytes(value):
+    """
+    Rough size of one session_state value.
+    """
+    if isinstance(value, (list, tuple)):
+        return sum(value_bytes(item) for item in value)
+    # Uploaded files report their own size, pickling would copy them
+    size = getattr(value, 'size', None)
+    if isinstance(size, int):
+        return size
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+def state_bytes(state):
+    """
+    Size of every key in a session_state, largest first.
+    """
+    sizes = {key: value_bytes(state[key]) for key in list(state.keys())}
+    return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+
+class SessionMeter:
+    """
+    Latest session_state size reported by each session served by this worker.
+    """
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def record(self, session_id, nbytes):
+        with self._lock:
+            self._sessions[session_id] = (nbytes, time.monotonic())
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.ttl
+        for session_id, (_, seen) in list(self._sessions.items()):
+            if seen < cutoff:
+                del self._sessions[session_id]
+
+    def worker_bytes(self):
+        with self._lock:
+            self._prune()
+            return sum(nbytes for nbytes, _ in self._sessions.values())
+
+    def session_count(self):
+        with self._lock:
+            self._prune()
+            return len(self._sessions)
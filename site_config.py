@@ -0,0 +1,331 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from datetime import date
+
+from checklists import get_checklist_registry
+from photo_store import DEFAULT_DATA_DIR
+
+# JSON file with the sites, zones, auditors and rotations, see DEFAULT_CONFIG.
+# Until it exists the built-in configuration is used.
+SITE_CONFIG_FILE = os.environ.get("ACL_SITE_CONFIG", os.path.join(DEFAULT_DATA_DIR, "sites.json"))
+
+
+# PBKDF2-SHA256 rounds for new password hashes. Each auditor's hash keeps
+# the count it was made with, so it can be raised without resetting logins.
+PASSWORD_ITERATIONS = 600000
+
+
+def password_hash(password, salt=None, iterations=PASSWORD_ITERATIONS):
+    """
+    The "password" entry of an auditor, salted with a fresh random salt
+    unless one is given, e.g.
+    python -c "import json, site_config; print(json.dumps(site_config.password_hash('secret')))"
+    """
+    salt = bytes.fromhex(salt) if salt else os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return {'salt': salt.hex(), 'iterations': iterations, 'hash': digest.hex()}
+
+
+# Zones are checklist zone names, or {"name": ..., "checklist": ...} for a
+# zone that uses another zone's checklist, e.g. a second cold room. In a
+# rotation, auditor i of the list covers zone_groups[(i + n) % len(zone_groups)]
+# in the n-th period of every_days days since start, on top of their own zones.
+# An auditor's password is the salted hash password_hash returns.
+DEFAULT_CONFIG = {
+    'sites': {
+        "ACL": {
+            'locations': ["Exterior", "Interior"],
+            'zones': [
+                "Entrance", "Receiving Bay", "Loading Bay", "Old Lay-up", "Old Lay-up Holding Room",
+                "Tray Set-up", "Bakery", "Cooked Food Fridge", "Dish Wash-Up Bay", "Dry Goods Store",
+                "Hot Kitchen", "Dishing Room", "Butchery", "Pots and Pans Washing Bay",
+                "Blast Freezers", "Deep Freezer", "Cold Room",
+            ],
+        },
+    },
+    'auditors': {
+        "callistus kyire": {
+            'site': "ACL",
+            'zones': ["Old Lay-up", "Tray Set-up", "Bakery", "Cooked Food Fridge", "Dish Wash-Up Bay"],
+            'password': {
+                'salt': "0e0cbdfa476a2cf258f3ad37f37a71c5", 'iterations': 600000,
+                'hash': "6bec9400bf1070b23b5bf7d0b70ba5bb0700cde09dc7e64707ee522a987da8b0",
+            },
+        },
+        "iddriss nyande": {
+            'site': "ACL",
+            'zones': ["Entrance", "Receiving Bay", "Loading Bay", "Old Lay-up Holding Room"],
+            'password': {
+                'salt': "3553dad6b0bc4fca2864ba1e82ded5ad", 'iterations': 600000,
+                'hash': "617992ba1b643d57242a9393917ab401b9bd6a0d4fb58c6e36f4bfde26127785",
+            },
+        },
+        "lovia": {
+            'site': "ACL",
+            'zones': ["Dry Goods Store", "Hot Kitchen", "Dishing Room", "Butchery", "Pots and Pans Washing Bay"],
+            'password': {
+                'salt': "b542e626cd84d113b68c7133548ad56a", 'iterations': 600000,
+                'hash': "3d34284dc06ab047afbeef4b66949376700f134e0c453f31acf67a644141a380",
+            },
+        },
+        "felix": {
+            'site': "ACL",
+            'zones': ["Blast Freezers", "Deep Freezer", "Cold Room"],
+            'password': {
+                'salt': "05aa22f5efefed36831a1247f7039662", 'iterations': 600000,
+                'hash': "bd2190f1853f1499e8130138b61c6e26a34fae00ee6cd7d9c8f63b940d3630fb",
+            },
+        },
+    },
+    'rotations': [],
+}
+
+Auditor = namedtuple('Auditor', ['name', 'site', 'zones', 'password'])
+
+# phases[n] maps each auditor to the zones they cover in the n-th period
+Rotation = namedtuple('Rotation', ['site', 'start', 'every_days', 'phases'])
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class SiteConfig:
+    """
+    Sites, zones, auditors and rotations, validated and indexed once.
+
+    Every lookup a rerun makes is a dict access, however many sites and
+    kitchens are configured.
+    """
+
+    def __init__(self, data, registry=None):
+        registry = registry or get_checklist_registry()
+        unknown = set(data) - {'sites', 'auditors', 'rotations'}
+        if unknown:
+            raise ConfigError(f"Unknown configuration sections: {', '.join(sorted(unknown))}")
+
+        # Zone and location names only have to be unique within a site, every
+        # site can have its own "Hot Kitchen"
+        self.site_zones = {}
+        self.site_locations = {}
+        self.site_checklists = {}
+        self.zones = []
+        self._first_site = {}
+        for site, spec in data.get('sites', {}).items():
+            self.site_checklists[site] = {}
+            zones = []
+            for entry in spec.get('zones', ()):
+                name, checklist = (entry, entry) if isinstance(entry, str) else (entry['name'], entry.get('checklist', entry['name']))
+                self._add_zone(site, name, checklist, registry)
+                zones.append(name)
+            for location in spec.get('locations', ()):
+                self._add_zone(site, location, location, registry)
+            self.site_zones[site] = tuple(zones)
+            self.site_locations[site] = tuple(spec.get('locations', ()))
+        self.zones = tuple(self.zones)
+
+        self.auditors = {}
+        for name, spec in data.get('auditors', {}).items():
+            site = spec.get('site')
+            if site not in self.site_zones:
+                raise ConfigError(f"Auditor {name!r} is assigned to unknown site {site!r}")
+            password = spec.get('password')
+            if not isinstance(password, dict) or not all(password.get(field) for field in ('salt', 'iterations', 'hash')):
+                raise ConfigError(f"Auditor {name!r} needs a password with salt, iterations and hash")
+            zones = tuple(spec.get('zones', ()))
+            self._check_zones(f"Auditor {name!r}", site, zones)
+            self.auditors[name.lower()] = Auditor(name.lower(), site, zones, password)
+
+        self.auditor_rotations = {}
+        for spec in data.get('rotations', ()):
+            rotation = self._rotation(spec)
+            for auditor in rotation.phases[0]:
+                self.auditor_rotations.setdefault(auditor, []).append(rotation)
+
+    def _add_zone(self, site, name, checklist, registry):
+        if name in self.site_checklists[site]:
+            raise ConfigError(f"Zone {name!r} is configured twice for {site!r}")
+        questions = registry.questions(checklist)
+        if not questions:
+            raise ConfigError(f"Zone {name!r} of {site!r} uses unknown checklist {checklist!r}")
+        self.site_checklists[site][name] = questions
+        if name not in self._first_site:
+            self._first_site[name] = site
+            self.zones.append(name)
+
+    def _check_zones(self, owner, site, zones):
+        for zone in zones:
+            if zone not in self.site_checklists[site]:
+                raise ConfigError(f"{owner} covers {zone!r}, which is not a zone of {site!r}")
+
+    def _rotation(self, spec):
+        site = spec.get('site')
+        if site not in self.site_zones:
+            raise ConfigError(f"Rotation for unknown site {site!r}")
+        try:
+            start = date.fromisoformat(spec['start'])
+        except (KeyError, TypeError, ValueError) as exc:
+            raise ConfigError(f"Rotation for {site!r} needs a start date as YYYY-MM-DD") from exc
+        every_days = int(spec.get('every_days', 7))
+        if every_days < 1:
+            raise ConfigError(f"Rotation for {site!r} must rotate at least every day")
+        auditors = [name.lower() for name in spec.get('auditors', ())]
+        groups = [tuple(group) for group in spec.get('zone_groups', ())]
+        if not auditors or not groups:
+            raise ConfigError(f"Rotation for {site!r} needs auditors and zone_groups")
+        for auditor in auditors:
+            if auditor not in self.auditors or self.auditors[auditor].site != site:
+                raise ConfigError(f"Rotation for {site!r} names {auditor!r}, who is not an auditor of that site")
+        for group in groups:
+            self._check_zones(f"Rotation for {site!r}", site, group)
+        phases = tuple(
+            {auditor: groups[(i + phase) % len(groups)] for i, auditor in enumerate(auditors)}
+            for phase in range(len(groups))
+        )
+        return Rotation(site, start, every_days, phases)
+
+    def auditor(self, name):
+        return self.auditors.get(name.lower())
+
+    def authenticate(self, name, password):
+        """
+        Return the auditor if the password matches, otherwise None.
+        """
+        auditor = self.auditor(name)
+        if auditor is None or not password:
+            return None
+        stored = auditor.password
+        try:
+            digest = password_hash(password, stored['salt'], int(stored['iterations']))['hash']
+        except (TypeError, ValueError):
+            logger.error("Auditor %r has a malformed password entry", auditor.name)
+            return None
+        if not hmac.compare_digest(digest, stored['hash']):
+            return None
+        return auditor
+
+    def zones_for(self, name, day=None):
+        """
+        An auditor's own zones plus those their rotations give them on a day.
+        """
+        auditor = self.auditor(name)
+        if auditor is None:
+            return ()
+        rotations = self.auditor_rotations.get(auditor.name)
+        if not rotations:
+            return auditor.zones
+        day = day or date.today()
+        zones = list(auditor.zones)
+        for rotation in rotations:
+            phase = ((day - rotation.start).days // rotation.every_days) % len(rotation.phases)
+            zones += [zone for zone in rotation.phases[phase][auditor.name] if zone not in zones]
+        return tuple(zones)
+
+    def site_for(self, name):
+        auditor = self.auditor(name)
+        return auditor.site if auditor else None
+
+    def locations_for(self, name):
+        auditor = self.auditor(name)
+        return self.site_locations[auditor.site] if auditor else ()
+
+    def checklist(self, zone, site=None):
+        """
+        Questions of a site's zone. Without a site, the first site that has
+        a zone of that name is used, for rows that do not say their site.
+        """
+        site = site or self._first_site.get(zone)
+        return self.site_checklists.get(site, {}).get(zone, ())
+
+    def zone_site(self, zone):
+        return self._first_site.get(zone)
+
+
+def load_site_config(path=SITE_CONFIG_FILE, registry=None):
+    if not os.path.exists(path):
+        return SiteConfig(DEFAULT_CONFIG, registry)
+    with open(path, encoding='utf-8') as f:
+        try:
+            data = json.load(f)
+        except ValueError as exc:
+            raise ConfigError(f"{path} is not valid JSON: {exc}") from exc
+    try:
+        return SiteConfig(data, registry)
+    except ConfigError:
+        raise
+    except (AttributeError, KeyError, TypeError, ValueError) as exc:
+        # A missing or wrongly typed field, e.g. a zone without a name
+        raise ConfigError(f"{path} is malformed: {exc!r}") from exc
+
+
+class SiteConfigWatcher:
+    """
+    Hold the current SiteConfig and reload it when the file changes.
+
+    The file is parsed on a watchdog thread, never during a rerun. A file
+    that fails to parse or validate is logged and the previous
+    configuration stays in use.
+    """
+
+    def __init__(self, path=SITE_CONFIG_FILE, registry=None):
+        self.path = os.path.abspath(path)
+        self.registry = registry
+        self.config = load_site_config(self.path, registry)
+        self._lock = threading.Lock()
+        self._observer = None
+
+    def reload(self):
+        with self._lock:
+            try:
+                self.config = load_site_config(self.path, self.registry)
+            except (OSError, ConfigError) as exc:
+                logger.error("Keeping the previous site configuration: %s", exc)
+                return False
+            except Exception:
+                # Anything else must not kill the observer thread either
+                logger.exception("Keeping the previous site configuration")
+                return False
+        logger.info("Reloaded the site configuration from %s", self.path)
+        return True
+
+    def start(self):
+        """
+        Watch the file's directory, so the file may also be created or
+        replaced later.
+        """
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        directory = os.path.dirname(self.path)
+        if self._observer is not None or not os.path.isdir(directory):
+            return self
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            # Only writes count, reading the file raises events of its own
+            def on_changed(self, event):
+                # Editors often save by writing a new file and renaming it
+                paths = {event.src_path, getattr(event, 'dest_path', None)}
+                if not event.is_directory and watcher.path in paths:
+                    watcher.reload()
+
+            on_created = on_modified = on_moved = on_deleted = on_changed
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), directory, recursive=False)
+        self._observer.start()
+        return self
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
@@ -0,0 +1,49 @@
+from datetime import date, datetime, timedelta
+
+ROLLUP_TABLES = {
+    "Daily": "daily_rollups",
+    "Weekly": "weekly_rollups",
+}
+
+
+def audit_day(conducted_on, created_at=None):
+    """
+    Day an audit counts towards: the date it was conducted on, otherwise the
+    day it was first saved.
+    """
+    value = conducted_on or created_at
+    if value is None:
+        return date.today()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value[:10])
+
+
+def week_start(day):
+    # Weeks start on Monday, as ISO weeks do
+    return day - timedelta(days=day.weekday())
+
+
+def rollup_keys(day):
+    """
+    The (table, period) pairs an audit day is rolled up into.
+    """
+    return (("daily_rollups", day.isoformat()), ("weekly_rollups", week_start(day).isoformat()))
+
+
+def load_trend(store, period="Weekly", periods=12, zones=None, auditor=None, today=None):
+    """
+    Non-compliance rate per zone over the last N days or weeks, read only
+    from the rollup tables.
+    """
+    today = today or date.today()
+    if period == "Daily":
+        since = today - timedelta(days=periods - 1)
+    else:
+        since = week_start(today) - timedelta(weeks=periods - 1)
+
+    trend = store.rollups(ROLLUP_TABLES[period], since, zones=zones, auditor=auditor)
+    trend['Non-compliance (%)'] = 100.0 * trend['Failed'] / trend['Answered'].where(trend['Answered'] > 0)
+    return trend